@@ -251,16 +251,38 @@ def _get_current_element():
     except exceptions.AttributeError:
         _raiseThreadInitError()
 
+# Last known mode of each circuit, None unless enabled with AMEEnableModeCache
+_mode_cache = None
+
 def _get_mode(circuit):
     """Returns the current mode for the given circuit"""
-    return int(afp.get(circuit + ':' + 'prop=mode'))
+    mode_cache = _mode_cache
+    if mode_cache is not None and circuit in mode_cache:
+        return mode_cache[circuit]
+    mode = int(afp.get(circuit + ':' + 'prop=mode'))
+    if mode_cache is not None:
+        mode_cache[circuit] = mode
+    return mode
+
+def _invalidate_mode(circuit=None):
+    """Forgets the cached mode of the given circuit, or of all circuits"""
+    mode_cache = _mode_cache
+    if mode_cache is None:
+        return
+    if circuit is None:
+        mode_cache.clear()
+    else:
+        mode_cache.pop(circuit, None)
 
 def _change_mode(circuit, mode):
     """Tries to set the current mode for the given circuit. Will raise
     ModeChangeError on failure."""
+    _invalidate_mode(circuit)
     try:
         afp.set(circuit + ':' + 'prop=mode', str(mode))
         new_mode = int(afp.get(circuit + ':' + 'prop=mode'))
+        if _mode_cache is not None:
+            _mode_cache[circuit] = new_mode
         if new_mode != _get_mode_index(mode):
             raise RuntimeError("could only switch to mode %s" % _get_mode_name(new_mode))
     except Exception as exc:
@@ -1207,6 +1229,46 @@ def AMESetParameterValue(data_path, value):
     datapath = _make_datapath(var_name, elem_path, circuit_name)
     return _AME.AMESetParameterValue(datapath, value)
 
+def AMESetParameterValues(values):
+    """Sets the values of several parameters or initial values of states at once.
+
+       list = AMESetParameterValues(dict)
+       list = AMESetParameterValues(list of (string, string))
+
+       Argument maps data paths, given as for AMESetParameterValue, to the values to be set.
+
+       All data paths are checked before any value is set, and each circuit is put in
+       parameter mode once for all of its values instead of once per value.
+       Raises DataPathError if a data path is invalid.
+
+       It returns the results of setting each value, grouped by circuit.
+
+       >>> AME.AMESetParameterValues({'theta@mass1port': '90', 'mass@mass1port': '10'})
+    """
+    if isinstance(values, dict):
+        values = values.items()
+
+    active_circuit = None
+    by_circuit = {}
+    for data_path, value in values:
+        if not isinstance(data_path, AMEParVar):
+            if not isinstance(data_path, str) or data_path.count(':') > 1 or data_path.count('@') > 1:
+                raise DataPathError("Invalid data path '%s'" % (data_path,))
+            if not data_path.count(':'):
+                # Look up the active circuit once, not once per data path
+                if active_circuit is None:
+                    active_circuit = AMEGetActiveCircuit()
+                data_path = data_path + ':' + active_circuit
+        var_name, elem_path, circuit_name = _parse_datapath(data_path)
+        if not var_name:
+            raise DataPathError("Invalid data path '%s'" % (data_path,))
+        by_circuit.setdefault(circuit_name, []).append((_make_datapath(var_name, elem_path, circuit_name), value))
+
+    ret = []
+    for circuit_name, circuit_values in by_circuit.items():
+        ret.extend(_AME.AMESetParameterValues(circuit_values, circuit_name))
+    return ret
+
 @unsupported_signature("data_path, password_list = None")
 def AMESetParameterDefaultValue(data_path):
     """Sets the default value of a parameter.
@@ -1320,6 +1382,34 @@ def AMESetActiveCircuit(circuit_name):
     """
     threading.currentThread()._current_circuit = circuit_name
 
+def AMEEnableModeCache(enable=True):
+    """Enables or disables the cache of the mode of each circuit.
+
+       AMEEnableModeCache([bool])
+
+       With the cache, functions that need a circuit in a given mode only query the
+       mode when it is not known yet, instead of before every call. The cache is updated
+       by every mode change and forgotten when a simulation starts, stops or ends.
+       Call AMEInvalidateModeCache after closing a circuit or changing its mode
+       outside the API.
+
+       >>> AME.AMEEnableModeCache()
+    """
+    global _mode_cache
+    if not enable:
+        _mode_cache = None
+    elif _mode_cache is None:
+        _mode_cache = {}
+
+def AMEInvalidateModeCache(circuit_name=None):
+    """Forgets the cached mode of a circuit, or of all circuits when no name is given.
+
+       AMEInvalidateModeCache([string])
+
+       >>> AME.AMEInvalidateModeCache('my_new_system(1)')
+    """
+    _invalidate_mode(circuit_name)
+
 def AMEGetOpenedCircuitList():
     """Gives the list of opened circuit names.
 
@@ -1547,27 +1637,10 @@ def AMEGetVariableFinalValue(data_path, dataset=None):
 
 # version 2013-04-02 SPm 0109212: Added default value to dataset parameter.
 # version 2014-08-08 AMp 153544: for getting values mode should be atleast parameter mode.
-def AMEGetVariableValues(data_path, dataset=None):
-    """Reads the variable values from the specifed result file of the current active circuit.
-
-       ((double, double), ...) = AMEGetVariableValues(string[, string])
-
-       First argument is either a string corresponding to the path of the variable, or an
-       AMEParVar object, as returned by AMEGetParVar or an AMEParVarIteration.
-
-       Second string argument is the extesnion of the results file to read.
-       By default it reads the 'circuit_name_.results' file, where 'circuit_name' is the name of
-       the active circuit.
-       Set it to '2' if you wish to read 'circuit_name_.results.2' results file.
-
-       It returns tuple containing pairs of times and values.
-
-       >>> AME.AMEGetVariableValues('press@fluidprops')
-       ((0.0, 9.2350599537811156e-005), (100.00000000000023, 9.0267566515905919), (200.00000000000045, 37.182831099831255),
-        (300.00000000000068, 84.014292131376521), (400.00000000000091, 149.32977089654025), (500.00000000000114, 232.67311255595379),
-       (600.00000000000136, 333.48061740306184), (700.00000000000159, 451.12132055729285), (800.00000000000182, 584.95112810520152),
-       (900.00000000000205, 734.28997366879526), (1000.0, 898.42224851630579))
-    """
+def _create_results_buffer(data_path, dataset=None):
+    """Asks Amesim for a buffer of the results of a variable of the current active circuit.
+       Returns its id and its values and sampling values as ctypes double arrays pointing
+       into the buffer, which must be released with _destroy_results_buffer."""
     varname, elempath, circuit = _parse_datapath(data_path)
     data_propid = make_data_property_id(varname, elempath, circuit)
     if _get_mode(circuit) < _get_mode_index(PARAMETER_MODE):
@@ -1589,16 +1662,77 @@ def AMEGetVariableValues(data_path, dataset=None):
         vptr = struct.unpack('P', base64.b64decode(tree.findall("values/addr")[0].text))[0]
         sptr = struct.unpack('P', base64.b64decode(tree.findall("sampling-values/addr")[0].text))[0]
 
-
     # Dereference pointers as pointing to double arrays
     from ctypes import cast, POINTER, c_double
-    values = cast(vptr, POINTER(c_double*vlen)).contents[:]
-    sampling_values = cast(sptr, POINTER(c_double*slen)).contents[:]
+    values_buffer = cast(vptr, POINTER(c_double*vlen)).contents
+    sampling_buffer = cast(sptr, POINTER(c_double*slen)).contents
+    return id, values_buffer, sampling_buffer
 
+def _destroy_results_buffer(id):
     afp.set("cmd=destroy_variable_results_buffer|id=%s" % id, "")
 
+def AMEGetVariableValues(data_path, dataset=None):
+    """Reads the variable values from the specifed result file of the current active circuit.
+
+       ((double, double), ...) = AMEGetVariableValues(string[, string])
+
+       First argument is either a string corresponding to the path of the variable, or an
+       AMEParVar object, as returned by AMEGetParVar or an AMEParVarIteration.
+
+       Second string argument is the extesnion of the results file to read.
+       By default it reads the 'circuit_name_.results' file, where 'circuit_name' is the name of
+       the active circuit.
+       Set it to '2' if you wish to read 'circuit_name_.results.2' results file.
+
+       It returns tuple containing pairs of times and values.
+
+       >>> AME.AMEGetVariableValues('press@fluidprops')
+       ((0.0, 9.2350599537811156e-005), (100.00000000000023, 9.0267566515905919), (200.00000000000045, 37.182831099831255),
+        (300.00000000000068, 84.014292131376521), (400.00000000000091, 149.32977089654025), (500.00000000000114, 232.67311255595379),
+       (600.00000000000136, 333.48061740306184), (700.00000000000159, 451.12132055729285), (800.00000000000182, 584.95112810520152),
+       (900.00000000000205, 734.28997366879526), (1000.0, 898.42224851630579))
+    """
+    id, values_buffer, sampling_buffer = _create_results_buffer(data_path, dataset)
+    try:
+        values = values_buffer[:]
+        sampling_values = sampling_buffer[:]
+    finally:
+        _destroy_results_buffer(id)
+
     return list(zip(sampling_values, values))
 
+def AMEGetVariableArrays(data_path, dataset=None):
+    """Reads the variable values from the specifed result file of the current active circuit
+       as two arrays instead of a list of pairs.
+
+       (array, array) = AMEGetVariableArrays(string[, string])
+
+       Arguments are the same as for AMEGetVariableValues.
+
+       It returns a tuple containing the times and the values. Each one is copied once from the
+       results buffer into a contiguous float64 numpy array, or into a memoryview of doubles
+       if numpy is not available.
+
+       >>> times, values = AME.AMEGetVariableArrays('press@fluidprops')
+       >>> values[-1]
+       898.42224851630579
+    """
+    id, values_buffer, sampling_buffer = _create_results_buffer(data_path, dataset)
+    try:
+        try:
+            import numpy
+        except ImportError:
+            values = memoryview(bytearray(values_buffer)).cast('d')
+            sampling_values = memoryview(bytearray(sampling_buffer)).cast('d')
+        else:
+            values = numpy.frombuffer(values_buffer, dtype=numpy.float64).copy()
+            sampling_values = numpy.frombuffer(sampling_buffer, dtype=numpy.float64).copy()
+    finally:
+        # The copies above own their memory, so the native buffer can go
+        _destroy_results_buffer(id)
+
+    return (sampling_values, values)
+
 def AMEClearUndoStack(circuit = None):
     """Clears the undo/redo stack for the working circuit, preventing the user
        from undoing the last set of actions.
@@ -2399,6 +2533,7 @@ def AMEStartSimulation(circuit=None):
     """
     circuit = _get_circuit(circuit)
     _ensure_mode(circuit, SIMULATION_MODE)
+    _invalidate_mode(circuit)
     afp.set(circuit + ':cmd=start_simulation', '')
 
 def AMESetPremierSubmodel(xmlString, circuit_name=None):
@@ -2432,6 +2567,7 @@ def AMEStopSimulation(circuit=None):
     """
     circuit = _get_circuit(circuit)
     _ensure_mode(circuit, SIMULATION_MODE)
+    _invalidate_mode(circuit)
     afp.set(circuit + ':cmd=stop_simulation', '')
 
 def AMEWaitForSimulationEnd(circuit=None):
@@ -2449,6 +2585,7 @@ def AMEWaitForSimulationEnd(circuit=None):
        False
     """
     circuit = _get_circuit(circuit)
+    _invalidate_mode(circuit)
     if afp.get(circuit + ':prop=wait_for_simulation_end') != "ok":
         raise AccessError("simulation failed or stopped")
 
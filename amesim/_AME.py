@@ -43,7 +43,7 @@ def _ensure_circuit(circuit=None, alias_path=None):
 /param mode [in] Required mode
 """
 def _ensure_mode(circuit, mode):
-   """Ensure we are in the given mode
+   """Ensure we are in the given mode. Uses the mode cache of AME when it is enabled
    """
    AME._ensure_mode(circuit, mode)
 
@@ -223,6 +223,17 @@ def AMESetParameterValue(data_path, value):
    ret = AME.afp.set('data_value', json.dumps(args))
    return ret
 
+def AMESetParameterValues(values, circuit=None):
+   circuit = _ensure_circuit(circuit)
+   AME._ensure_mode_at_least(circuit, PARAMETER_MODE)
+   ret = []
+   for data_path, value in values:
+      args = {}
+      args['data_path'] = str(data_path)
+      args['value'] = str(value) if value != None else str('')
+      ret.append(AME.afp.set('data_value', json.dumps(args)))
+   return ret
+
 def AMESetParameterDefaultValue(data_path):
    args = {}
    args['data_path'] = str(data_path)
@@ -1,4 +1,5 @@
 import argparse
+import sys
 
 from simulation_service import SimulationService
 
@@ -6,7 +7,9 @@ from simulation_service import SimulationService
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-c", "--config", type=str, help="path to the configuration data (.json)", required=True)
+    parser.add_argument("-c", "--config", type=str, nargs="+", help="path to the configuration data (.json)", required=True)
+    parser.add_argument("-w", "--workers", type=int, help="run the configs in parallel on this many worker processes")
+    parser.add_argument("--headless", action="store_true", help="never open plot windows (default when there is no display)")
 
     return parser.parse_args()
 
@@ -14,13 +17,22 @@ def parse_args():
 def _main():
    args = parse_args()
 
-   config_file = args.config
+   config_files = args.config
 
-   simulation_service = SimulationService()
+   if args.workers is not None or len(config_files) > 1:
+      results = SimulationService.run_pool(config_files, args.workers)
+      if any(error is not None for _, error in results):
+         sys.exit(1)
+      return
+
+   # Tracing set by the config starts with the service, so the API initialization is traced too
+   data = SimulationService._parse_config_file(config_files[0])
+   simulation_service = SimulationService(headless=True if args.headless else None,
+                                          trace_report=data.get("trace_report"), chrome_trace=data.get("chrome_trace"))
    
-   simulation_service.run_from_config_file(config_file)
+   print(f"Running from config file: {config_files[0]}")
+   simulation_service.run_from_config(data)
    
 
 if __name__ == '__main__':
     _main()
-
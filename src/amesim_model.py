@@ -0,0 +1,125 @@
+import ast
+import marshal
+from typing import Callable, Dict, List, NamedTuple
+
+##############################################################################################
+
+# Position of the parameter values among the other calls of the model script
+PARAMETERS_MARKER = "<parameters>"
+
+# Bumped when the serialized form changes, so older disk cache entries are parsed again
+FORMAT_VERSION = 2
+
+
+class ModelCall(NamedTuple):
+   function: str
+   args: tuple
+   kwargs: dict
+
+
+class AmesimModel:
+   """Model script generated by Amesim, parsed into its API calls.
+
+   Parameter values are kept apart from the other calls, one value per data path, so they
+   can be overridden before the model is built and each parameter is set exactly once.
+   All other calls keep the order of the script. Only connections may follow the parameter
+   values, as in the scripts Amesim generates.
+   """
+
+   def __init__(self, create_call: ModelCall, calls: List[ModelCall], parameters: Dict[str, str]):
+      self.create_call = create_call
+      self.calls = calls
+      self.parameters = parameters
+
+
+   @property
+   def circuit_name(self) -> str:
+      return self.create_call.args[0]
+
+
+   @property
+   def components(self) -> List[ModelCall]:
+      return [call for call in self.calls if call.function in ("AMEAddComponent", "AMEAddDynamicComponent")]
+
+
+   @property
+   def submodels(self) -> List[ModelCall]:
+      return [call for call in self.calls if call.function == "AMEChangeSubmodel"]
+
+
+   @property
+   def connections(self) -> List[ModelCall]:
+      return [call for call in self.calls if call.function.startswith("AMEConnect")]
+
+
+   @classmethod
+   def parse(cls, code: str) -> "AmesimModel":
+      """Parse trimmed model code (AMECreateCircuit up to AMEGenerateCode).
+      Raises ValueError if it contains anything but calls with literal arguments, or if a call
+      other than a connection follows the parameter values: the values are all set at the
+      position of the first one, so that call would run before values it may depend on."""
+      create_call = None
+      calls = []
+      parameters = {}
+
+      for statement in ast.parse(code).body:
+         if not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)
+                 and isinstance(statement.value.func, ast.Name)):
+            raise ValueError(f"Error: Unable to parse model statement on line {statement.lineno}")
+         node = statement.value
+         args = tuple(ast.literal_eval(arg) for arg in node.args)
+         kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in node.keywords}
+         function = node.func.id
+
+         if function == "AMECreateCircuit":
+            create_call = ModelCall(function, args, kwargs)
+         elif function == "AMESetParameterValue" and len(args) == 2 and not kwargs:
+            if not parameters:
+               calls.append(ModelCall(PARAMETERS_MARKER, (), {}))
+            # Repeated data paths keep their first position and last value
+            parameters[args[0]] = args[1]
+         elif parameters and not function.startswith("AMEConnect"):
+            raise ValueError(f"Error: Unable to parse model, {function} on line {statement.lineno} "
+                             f"follows the parameter values")
+         else:
+            calls.append(ModelCall(function, args, kwargs))
+
+      if create_call is None:
+         raise ValueError("Error: Unable to parse file. Please use file generated by Amesim")
+      if not parameters:
+         calls.append(ModelCall(PARAMETERS_MARKER, (), {}))
+      return cls(create_call, calls, parameters)
+
+
+   def replay(self, api: Dict[str, Callable], overrides: Dict[str, str] = None) -> Dict[str, str]:
+      """Build the model through the API functions in api, with overrides replacing parameter values.
+      Returns the value set for every parameter."""
+      parameters = dict(self.parameters)
+      if overrides:
+         parameters.update(overrides)
+
+      api["AMECreateCircuit"](*self.create_call.args, **self.create_call.kwargs)
+      for call in self.calls:
+         if call.function == PARAMETERS_MARKER:
+            for data_path, value in parameters.items():
+               api["AMESetParameterValue"](data_path, value)
+         else:
+            api[call.function](*call.args, **call.kwargs)
+
+      return parameters
+
+
+   def dumps(self) -> bytes:
+      """Compact serialized form, see loads"""
+      calls = tuple((call.function, call.args, call.kwargs) for call in self.calls)
+      return marshal.dumps((FORMAT_VERSION, tuple(self.create_call), calls, self.parameters))
+
+
+   @classmethod
+   def loads(cls, data: bytes) -> "AmesimModel":
+      """Raises ValueError if data was serialized by another version"""
+      fields = marshal.loads(data)
+      if not isinstance(fields, tuple) or len(fields) != 4 or fields[0] != FORMAT_VERSION:
+         raise ValueError("Error: Unsupported model cache format")
+      _, create_call, calls, parameters = fields
+      return cls(ModelCall(*create_call), [ModelCall(*call) for call in calls], parameters)
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple, Union
+
+from simulation_service import POLL_MAX_S, POLL_MIN_S, SimulationService, save_output_files
+
+try:
+  from ame_apy import *
+except ImportError:
+  print('Unable to import Simcenter Amesim API module.\nCheck the AME environment variable.')
+
+##############################################################################################
+
+
+def _init_api_thread(parent: threading.Thread) -> None:
+   # Like AME.Thread: a thread using the API starts on the circuit and element of its parent
+   for attribute in ("_current_circuit", "_current_element"):
+      if hasattr(parent, attribute):
+         setattr(threading.current_thread(), attribute, getattr(parent, attribute))
+
+
+def _export(outputs: Dict[str, Sequence[float]], variable_names: List[str], output_path: str,
+            options: Tuple[str, str, bool, bool]) -> None:
+   # The export threads already run in parallel, so each one renders its plots serially
+   # instead of starting worker processes of its own
+   save_output_files(outputs, variable_names, output_path, *options)
+
+
+class AsyncSimulationService:
+   """asyncio front end of SimulationService, for running many simulations from one event loop.
+
+   Each run() builds its model as a circuit of its own and starts the simulation without
+   waiting for it, then polls for the end with asyncio.sleep. Meanwhile the event loop is
+   free for other runs, uploads or post-processing. All Amesim API calls go through a
+   single thread, so they never block the loop or run concurrently. Files are saved in a
+   separate pool of threads.
+
+   Runs are independent: each one uses the default settings with those of its own config.
+   Tracing covers the whole session, so it is set with trace_report and chrome_trace here
+   and those keys of the configs are ignored.
+
+      async with AsyncSimulationService() as service:
+         results = await asyncio.gather(*(service.run(config) for config in configs))
+   """
+
+   def __init__(self, export_workers: int = None, trace_report: str = None, chrome_trace: str = None):
+      self._api_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="amesim-api",
+                                              initializer=_init_api_thread,
+                                              initargs=(threading.current_thread(),))
+      self._export_executor = ThreadPoolExecutor(max_workers=export_workers, thread_name_prefix="export")
+      self.service = None
+      self._trace_report = trace_report
+      self._chrome_trace = chrome_trace
+
+
+   async def _call_api(self, function, *args):
+      return await asyncio.get_running_loop().run_in_executor(self._api_executor, function, *args)
+
+
+   async def open(self) -> None:
+      """Initialize the API, done by the first run if not called before"""
+      if self.service is None:
+         # Plots are only saved to files, never shown from the event loop
+         self.service = await self._call_api(lambda: SimulationService(headless=True, session=True,
+                                                                       trace_report=self._trace_report,
+                                                                       chrome_trace=self._chrome_trace))
+
+
+   async def close(self) -> None:
+      if self.service is not None:
+         await self._call_api(self._shutdown)
+         self.service = None
+      self._api_executor.shutdown()
+      self._export_executor.shutdown()
+
+
+   async def __aenter__(self) -> "AsyncSimulationService":
+      await self.open()
+      return self
+
+
+   async def __aexit__(self, *exc_info) -> None:
+      await self.close()
+
+
+   async def run(self, config: Union[str, dict], output_path: str = None) -> Dict[str, Sequence[float]]:
+      """Run a config (file or parsed) and return its outputs as SimulationService.get_outputs does.
+
+      With generate_output_files the files are saved to output_path, by default ./output as
+      with SimulationService, so concurrent runs should each be given their own output_path.
+      Sweeps and batches are not supported, run them with SimulationService.
+      """
+      await self.open()
+      loop = asyncio.get_running_loop()
+
+      if isinstance(config, str):
+         print(f"Running from config file: {config}")
+         data = await loop.run_in_executor(self._export_executor, SimulationService._parse_config_file, config)
+      else:
+         data = config
+      if "sweep" in data or "batch" in data:
+         raise RuntimeError("Error: 'sweep' and 'batch' are not supported by AsyncSimulationService")
+
+      starting = asyncio.ensure_future(self._call_api(self._start, data))
+      try:
+         circuit, parameter_values, export_options = await asyncio.shield(starting)
+      except asyncio.CancelledError:
+         # The API thread builds the circuit anyway, close it once it's built
+         starting.add_done_callback(self._abort_started)
+         raise
+
+      try:
+         poll_s = POLL_MIN_S
+         while await self._call_api(AMEIsSimulationRunning, circuit):
+            await asyncio.sleep(poll_s)
+            poll_s = min(poll_s * 2, POLL_MAX_S)
+      except BaseException:
+         # Cancelled or failed while running, don't leave the circuit open
+         await self._call_api(self._abort, circuit, parameter_values)
+         raise
+
+      outputs = await self._call_api(self._finish, circuit, parameter_values, data["outputs"])
+
+      if data["generate_output_files"]:
+         if output_path is None:
+            output_path = os.path.join(os.getcwd(), "output")
+         await loop.run_in_executor(self._export_executor, _export, outputs, data["outputs"], output_path,
+                                    export_options)
+
+      return outputs
+
+
+   def _abort_started(self, starting: asyncio.Future) -> None:
+      if not starting.cancelled() and starting.exception() is None:
+         circuit, parameter_values, _ = starting.result()
+         self._api_executor.submit(self._abort, circuit, parameter_values)
+
+
+   # The methods below run in the API thread
+
+   def _start(self, data: dict) -> Tuple[str, Dict[str, str], tuple]:
+      """Build the config's model as a new circuit and start its simulation.
+      Also returns the export settings of the run, the next run may change those of the service."""
+      service = self.service
+      # Defaults with the settings of this run only, not those of the previous runs
+      run_settings = {key: value for key, value in data.items() if key not in ("trace_report", "chrome_trace")}
+      service._apply_config_settings(run_settings, reset=True)
+
+      # The circuits of the previous runs may still be running
+      service.load_model(data["model_file"], service._config_parameter_values(data), new_circuit=True)
+
+      circuit = AMEGetActiveCircuit()
+      try:
+         service.set_runtime_parameters(str(data["start_time_s"]), str(data["end_time_s"]), str(data["interval_s"]))
+         print(f"Starting simulation of {circuit}")
+         AMEStartSimulation(circuit)
+      except:
+         print("Error starting simulation")
+         service._close_circuit()
+         raise
+      export_options = (service.output_format, service.csv_float_format, service.decimate_plots, service.single_pdf)
+      return circuit, service._parameter_values, export_options
+
+
+   def _finish(self, circuit: str, parameter_values: Dict[str, str],
+               variable_names: List[str]) -> Dict[str, Sequence[float]]:
+      """Collect the outputs of a finished simulation and close its circuit"""
+      service = self.service
+      service._activate_circuit(circuit, parameter_values)
+      try:
+         # Raises if the simulation failed
+         AMEWaitForSimulationEnd(circuit)
+         return service.get_outputs(variable_names)
+      except:
+         print(f"Error running simulation of {circuit}")
+         raise
+      finally:
+         service._close_circuit()
+         service._output_cache = {}
+
+
+   def _shutdown(self) -> None:
+      # Every run closed its own circuit already
+      print("Quitting Simulation Service...")
+      self.service.save_trace()
+      AMECloseAPI(False)
+      self.service.tracer.uninstall()
+
+
+   def _abort(self, circuit: str, parameter_values: Dict[str, str]) -> None:
+      service = self.service
+      service._activate_circuit(circuit, parameter_values)
+      if AMEIsSimulationRunning(circuit):
+         AMEStopSimulation(circuit)
+      service._close_circuit()
@@ -0,0 +1,356 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import types
+from typing import Callable, Dict, List
+
+##############################################################################################
+
+# Benchmarks of the SimulationService pipeline on the fake afp module, see fake_afp.
+#
+#   python benchmark.py --quick --save-baseline baseline.json
+#   ... change the code ...
+#   python benchmark.py --quick --baseline baseline.json
+#
+# Every case is timed best of --repeat runs and reported as a throughput (lines, parameters,
+# values or runs per second). With --baseline, the run fails if any case is slower than the
+# baseline by more than --threshold.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+AMESIM_DIR = os.path.join(os.path.dirname(SRC_DIR), "amesim")
+
+DEFAULT_THRESHOLD = 0.2
+
+MODEL_LINES = [1000, 10000, 100000]
+PARAMETER_COUNTS = [10, 100, 1000, 10000]
+OUTPUT_SAMPLES = [1000, 100000, 1000000, 10000000]
+OUTPUT_VARIABLES = [1, 10, 100]
+PLOT_SAMPLES = [1000, 100000, 1000000]
+
+QUICK_MODEL_LINES = [1000, 10000]
+QUICK_PARAMETER_COUNTS = [10, 1000]
+QUICK_OUTPUT_SAMPLES = [1000, 100000]
+QUICK_OUTPUT_VARIABLES = [1, 10]
+QUICK_PLOT_SAMPLES = [1000, 100000]
+
+# Output cases with more samples times variables are skipped, 10M doubles are 80 MB per column
+DEFAULT_MAX_VALUES = 10000000
+
+
+def _install_fake_api() -> None:
+   """Make ame_apy the reference AME wrappers of amesim/ running on fake_afp"""
+   import fake_afp
+   fake_afp.install()
+   if AMESIM_DIR not in sys.path:
+      sys.path.insert(0, AMESIM_DIR)
+   import AME
+
+   ame_apy = types.ModuleType("ame_apy")
+   for name, value in vars(AME).items():
+      if name.startswith("AME") or name.isupper():
+         setattr(ame_apy, name, value)
+
+   # ame_apy functions that AME, which runs inside Amesim, doesn't have
+   def AMEInitAPI(*args):
+      pass
+
+   def AMECloseAPI(*args):
+      pass
+
+   def AMECreateCircuit(name=None):
+      circuit = fake_afp.open_circuit(name or "unnamed_system")
+      AME.AMESetActiveCircuit(circuit)
+      return circuit
+
+   def AMECloseCircuit(*args):
+      fake_afp.close_circuit(AME.AMEGetActiveCircuit())
+
+   for function in (AMEInitAPI, AMECloseAPI, AMECreateCircuit, AMECloseCircuit):
+      setattr(ame_apy, function.__name__, function)
+   sys.modules["ame_apy"] = ame_apy
+
+
+@contextlib.contextmanager
+def _quiet():
+   # The service prints every step, which would dominate the timings of small cases
+   with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      yield
+
+
+def _time(function: Callable[[int], None], repeat: int, setup: Callable[[int], None] = None) -> float:
+   """Best wall time of function(i) over repeat runs, setup(i) runs untimed before each one"""
+   best = None
+   for i in range(repeat):
+      with _quiet():
+         if setup is not None:
+            setup(i)
+         start = time.perf_counter()
+         function(i)
+         elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+   return best
+
+
+def generate_model(model_file: str, n_lines: int, n_parameters: int = None) -> List[str]:
+   """Write a model script like the ones Amesim generates, of about n_lines lines.
+   Returns the data paths of its parameters."""
+   n_components = max(1, n_lines // 100)
+   lines = [
+      "#-*- coding: iso-8859-1 -*-",
+      "# Generated for benchmarks",
+      "import os, sys",
+      "AMEInitAPI()",
+      "AMECreateCircuit('bench')",
+   ]
+   for i in range(n_components):
+      lines.append(f"AMEAddComponent('mass2port', 'mass_{i}', ({i * 50}, 100))")
+      lines.append(f"AMEChangeSubmodel('mass_{i}', 'MAS002', r'$AME\\libmec\\submodels')")
+   for i in range(1, n_components):
+      lines.append(f"AMEConnectTwoPorts('mass_{i - 1}', 1, 'mass_{i}', 0)")
+
+   if n_parameters is None:
+      n_parameters = max(1, n_lines - len(lines) - 2)
+   parameters = [f"p{i}@mass_{i % n_components}" for i in range(n_parameters)]
+   lines.extend(f"AMESetParameterValue('{data_path}', '{i}.0')" for i, data_path in enumerate(parameters))
+
+   lines.append("AMEGenerateCode()")
+   lines.append("AMECloseCircuit(True)")
+   with open(model_file, 'w') as file:
+      file.write('\n'.join(lines) + '\n')
+   return parameters
+
+
+class Benchmark:
+   def __init__(self, work_dir: str, repeat: int, quick: bool, max_values: int):
+      from simulation_service import SimulationService
+
+      self.work_dir = work_dir
+      self.repeat = repeat
+      self.quick = quick
+      self.max_values = max_values
+      self.results = {}
+      with _quiet():
+         self.service = SimulationService(headless=True)
+
+
+   def record(self, name: str, seconds: float, units: int, unit: str) -> None:
+      self.results[name] = {"seconds": seconds, "units": units, "unit": unit, "throughput": units / seconds}
+      print(f"{name:<55} {seconds * 1000:>12.3f} ms {units / seconds:>16,.0f} {unit}/s")
+
+
+   def skip(self, name: str, reason: str) -> None:
+      self.results[name] = {"skipped": reason}
+      print(f"{name:<55} skipped: {reason}")
+
+
+   def load_model(self) -> None:
+      from model_cache import ModelCache
+
+      for n_lines in (QUICK_MODEL_LINES if self.quick else MODEL_LINES):
+         model_file = os.path.join(self.work_dir, f"model_{n_lines}.py")
+         generate_model(model_file, n_lines)
+
+         for structured in (False, True):
+            variant = "structured" if structured else "script"
+            self.service.structured_model = structured
+
+            # Cold: every load parses the script again
+            def new_cache(i):
+               self.service.model_cache = ModelCache()
+            seconds = _time(lambda i: self.service.load_model(model_file), self.repeat, new_cache)
+            self.record(f"load_model/{variant}/cold/lines={n_lines}", seconds, n_lines, "lines")
+
+            # Cached: the parsed script is reused, only the API calls remain
+            self.service.model_cache = ModelCache()
+            with _quiet():
+               self.service.load_model(model_file)
+            seconds = _time(lambda i: self.service.load_model(model_file), self.repeat)
+            self.record(f"load_model/{variant}/cached/lines={n_lines}", seconds, n_lines, "lines")
+
+      self.service.structured_model = False
+
+
+   def set_parameters(self) -> None:
+      for n_parameters in (QUICK_PARAMETER_COUNTS if self.quick else PARAMETER_COUNTS):
+         model_file = os.path.join(self.work_dir, f"parameters_{n_parameters}.py")
+         parameters = generate_model(model_file, 1000, n_parameters)
+         with _quiet():
+            self.service.load_model(model_file)
+
+         # New values on every run, unchanged values would not be sent at all
+         def set_one_by_one(i):
+            for data_path in parameters:
+               self.service.set_model_parameter(data_path, f"{i + 1}.5")
+         seconds = _time(set_one_by_one, self.repeat)
+         self.record(f"set_model_parameter/parameters={n_parameters}", seconds, n_parameters, "parameters")
+
+         def set_all(i):
+            self.service.set_model_parameters({data_path: f"{i + 1}.25" for data_path in parameters})
+         seconds = _time(set_all, self.repeat)
+         self.record(f"set_model_parameters/parameters={n_parameters}", seconds, n_parameters, "parameters")
+
+
+   def _run(self, n_samples: int) -> None:
+      """Run the loaded model so every variable has n_samples samples"""
+      with _quiet():
+         self.service.set_runtime_parameters("0", str(n_samples - 1), "1")
+         self.service.run_simulation()
+
+
+   def outputs(self) -> None:
+      model_file = os.path.join(self.work_dir, "outputs.py")
+      generate_model(model_file, 1000)
+      with _quiet():
+         self.service.load_model(model_file)
+
+      for n_samples in (QUICK_OUTPUT_SAMPLES if self.quick else OUTPUT_SAMPLES):
+         self._run(n_samples)
+         for n_variables in (QUICK_OUTPUT_VARIABLES if self.quick else OUTPUT_VARIABLES):
+            size = f"samples={n_samples}/variables={n_variables}"
+            n_values = n_samples * n_variables
+            if n_values > self.max_values:
+               self.skip(f"get_output_values/{size}", f"more than {self.max_values} values")
+               self.skip(f"save_output_data_csv/{size}", f"more than {self.max_values} values")
+               continue
+            variables = [f"x{j}@mass_0" for j in range(n_variables)]
+
+            def clear_cache(i):
+               self.service._output_cache = {}
+            def fetch(i):
+               for variable in variables:
+                  self.service.get_output_values(variable)
+            seconds = _time(fetch, self.repeat, clear_cache)
+            self.record(f"get_output_values/{size}", seconds, n_values, "values")
+
+            # The outputs are fetched already, this times the export alone
+            output_path = os.path.join(self.work_dir, "csv")
+            seconds = _time(lambda i: self.service.save_output_data_csv(variables, output_path), self.repeat)
+            self.record(f"save_output_data_csv/{size}", seconds, n_values, "values")
+
+
+   def plots(self) -> None:
+      try:
+         import matplotlib
+      except ImportError:
+         self.skip("save_plot_pdf", "matplotlib is not installed")
+         return
+
+      model_file = os.path.join(self.work_dir, "plots.py")
+      generate_model(model_file, 1000)
+      with _quiet():
+         self.service.load_model(model_file)
+
+      for n_samples in (QUICK_PLOT_SAMPLES if self.quick else PLOT_SAMPLES):
+         self._run(n_samples)
+         output_path = os.path.join(self.work_dir, "plots")
+         seconds = _time(lambda i: self.service.save_plot_pdf("x0@mass_0", output_path), self.repeat)
+         self.record(f"save_plot_pdf/samples={n_samples}", seconds, n_samples, "values")
+
+
+   def end_to_end(self) -> None:
+      from simulation_service import SimulationService
+
+      try:
+         import matplotlib
+      except ImportError:
+         self.skip("run_from_config_file", "matplotlib is not installed")
+         return
+
+      run_dir = os.path.join(self.work_dir, "end_to_end")
+      os.makedirs(run_dir, exist_ok=True)
+      parameters = generate_model(os.path.join(run_dir, "model.py"), 1000)
+      config_file = os.path.join(run_dir, "config.json")
+      with open(config_file, 'w') as file:
+         json.dump({
+            "model_file": "model.py",
+            "start_time_s": 0,
+            "end_time_s": 100,
+            "interval_s": 0.01,
+            "parameters": {data_path: 1 for data_path in parameters[:10]},
+            "time_series_data": {},
+            "outputs": [f"x{j}@mass_0" for j in range(5)],
+            "generate_output_files": True,
+            "headless": True,
+            "plot_workers": 1,
+         }, file)
+
+      current_dir = os.getcwd()
+      os.chdir(run_dir)
+      try:
+         seconds = _time(lambda i: SimulationService(headless=True).run_from_config_file(config_file), self.repeat)
+      finally:
+         os.chdir(current_dir)
+      self.record("run_from_config_file", seconds, 1, "runs")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+   """Print the change of each case from the baseline, return the cases slower than threshold allows"""
+   regressions = []
+   print(f"\nCompared to baseline (threshold {threshold:.0%}):")
+   for name, result in results.items():
+      base = baseline.get(name)
+      if base is None or "throughput" not in base or "throughput" not in result:
+         continue
+      ratio = result["throughput"] / base["throughput"]
+      regressed = ratio < 1 - threshold
+      if regressed:
+         regressions.append(name)
+      print(f"{name:<55} {ratio - 1:>+8.1%}{'  REGRESSION' if regressed else ''}")
+   return regressions
+
+
+def main(argv: List[str] = None) -> int:
+   parser = argparse.ArgumentParser(description="Benchmark SimulationService on a fake Amesim API")
+   parser.add_argument("--quick", action="store_true", help="smaller sizes, for a check in a few seconds")
+   parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the best one counts")
+   parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every afp call")
+   parser.add_argument("--simulation", type=float, default=0.0, help="seconds a simulation takes")
+   parser.add_argument("--max-values", type=int, default=DEFAULT_MAX_VALUES,
+                       help="skip output cases with more samples times variables")
+   parser.add_argument("--cases", nargs="+", default=["load_model", "set_parameters", "outputs", "plots", "end_to_end"],
+                       help="cases to run")
+   parser.add_argument("-o", "--output", help="save the results as JSON")
+   parser.add_argument("--baseline", help="results JSON to compare against")
+   parser.add_argument("--save-baseline", help="also save the results as the new baseline")
+   parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                       help="fail if a case loses more than this fraction of its baseline throughput")
+   args = parser.parse_args(argv)
+
+   _install_fake_api()
+   import fake_afp
+   fake_afp.configure(latency=args.latency, simulation=args.simulation)
+
+   with tempfile.TemporaryDirectory() as work_dir:
+      benchmark = Benchmark(work_dir, args.repeat, args.quick, args.max_values)
+      for case in args.cases:
+         getattr(benchmark, case)()
+
+   report = {
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "latency_s": args.latency,
+      "simulation_s": args.simulation,
+      "results": benchmark.results,
+   }
+   for output_path in (args.output, args.save_baseline):
+      if output_path:
+         with open(output_path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+   if args.baseline:
+      with open(args.baseline, 'r') as file:
+         baseline = json.load(file)
+      regressions = compare(benchmark.results, baseline["results"], args.threshold)
+      if regressions:
+         print(f"{len(regressions)} cases regressed more than {args.threshold:.0%}")
+         return 1
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,291 @@
+import base64
+import ctypes
+import itertools
+import json
+import math
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from array import array
+from typing import Dict
+
+##############################################################################################
+
+# Pure-Python stand-in for the afp module of Amesim, for running amesim/AME.py off the lab.
+#
+#   import fake_afp
+#   fake_afp.install()                       # must come before importing AME
+#   fake_afp.configure(latency=0.0005, simulation=0.2)
+#   import AME
+#
+# It keeps circuits with their mode, parameter values and run parameters. A simulation
+# "runs" for simulation_s of wall time, and its results are deterministic waveforms stored
+# in real ctypes double arrays behind create_variable_results_buffer, so AME reads them
+# through pointers exactly as it does from Amesim. Commands it doesn't model are accepted
+# and only counted.
+
+# Mode names in the order of their index, as in AME._get_mode_index
+MODES = ["sketch_mode", "submodel_mode", "parameter_mode", "simulation_mode"]
+SIMULATION_MODE_INDEX = 3
+
+DEFAULT_RUN_PARAMETERS = {"start_time_s": "0", "stop_time_s": "10", "interval_s": "0.1"}
+
+
+class AccessError(Exception):
+   """Raised for requests Amesim would reject, like afp.AccessError"""
+
+
+class _Circuit:
+   def __init__(self, name: str):
+      self.name = name
+      self.mode = 0
+      self.parameters = {}
+      self.run_parameters = dict(DEFAULT_RUN_PARAMETERS)
+      self.components = []
+      self.run_end = None
+      self.stopped = False
+      self.has_results = False
+      # Sampling (start, interval, number of samples) and waveforms of the last run,
+      # the waveforms are generated on first read
+      self.sampling = None
+      self.results = {}
+
+
+# Per-call latency in seconds, and latencies of single commands (e.g. "prop=mode") that override it
+latency_s = 0.0
+command_latency_s = {}
+
+# Wall time a simulation takes
+simulation_s = 0.0
+
+_lock = threading.RLock()
+_circuits = {}
+_circuit_numbers = itertools.count(1)
+_buffers = {}
+_buffer_ids = itertools.count(1)
+_call_counts = {}
+
+
+def configure(latency: float = None, command_latency: Dict[str, float] = None, simulation: float = None) -> None:
+   """Set the latency of every call, of single commands, and the duration of a simulation, in seconds"""
+   global latency_s, command_latency_s, simulation_s
+   if latency is not None:
+      latency_s = latency
+   if command_latency is not None:
+      command_latency_s = dict(command_latency)
+   if simulation is not None:
+      simulation_s = simulation
+
+
+def install() -> None:
+   """Make this module the one imported as afp"""
+   sys.modules["afp"] = sys.modules[__name__]
+
+
+def reset() -> None:
+   """Close every circuit and forget the call counts"""
+   with _lock:
+      _circuits.clear()
+      _buffers.clear()
+      _call_counts.clear()
+
+
+def call_counts() -> Dict[str, int]:
+   """Number of calls of each "get <command>" and "set <command>" so far"""
+   with _lock:
+      return dict(_call_counts)
+
+
+def open_circuit(system_name: str = "unnamed_system") -> str:
+   """Open an empty circuit, like opening a model in Amesim.
+   Returns its name, the system name with a unique identifier like "plane(2)"."""
+   with _lock:
+      name = f"{system_name}({next(_circuit_numbers)})"
+      _circuits[name] = _Circuit(name)
+      return name
+
+
+def close_circuit(name: str) -> None:
+   with _lock:
+      _circuits.pop(name, None)
+
+
+def _split(target: str):
+   """Split a target into its path and its command, e.g. ("circuit(1)", "prop=mode", {})"""
+   parts = target.split(':')
+   command = parts[-1]
+   arguments = {}
+   if '|' in command:
+      command, *pairs = command.split('|')
+      for pair in pairs:
+         key, _, value = pair.partition('=')
+         arguments[key] = urllib.parse.unquote(value)
+   return parts[:-1], command, arguments
+
+
+def _wait(command: str) -> None:
+   delay = command_latency_s.get(command, latency_s)
+   if delay > 0:
+      time.sleep(delay)
+
+
+def _count(method: str, command: str) -> None:
+   key = f"{method} {command}"
+   _call_counts[key] = _call_counts.get(key, 0) + 1
+
+
+def _circuit(name: str) -> _Circuit:
+   try:
+      return _circuits[name]
+   except KeyError:
+      raise AccessError(f"Circuit '{name}' is not open")
+
+
+def _is_running(circuit: _Circuit) -> bool:
+   return circuit.run_end is not None and not circuit.stopped and time.perf_counter() < circuit.run_end
+
+
+def _waveform(data_path: str, times: array) -> array:
+   """Deterministic signal of a variable, different for each data path"""
+   seed = zlib.crc32(data_path.encode())
+   amplitude = 1 + seed % 100
+   omega = 0.5 + (seed >> 8) % 50 / 10
+   phase = (seed >> 16) % 628 / 100
+   return array('d', (amplitude * math.sin(omega * t + phase) for t in times))
+
+
+def _create_results_buffer(circuit: _Circuit, data_path: str, dataset: str) -> str:
+   if not circuit.has_results:
+      raise AccessError(f"No results for circuit '{circuit.name}'")
+
+   start, interval, n_samples = circuit.sampling
+
+   # Generating the signal is slow in Python, don't count it on every read of the same results.
+   # Only the last run's are kept, as Amesim only keeps the last results file
+   key = (data_path, dataset)
+   if key not in circuit.results:
+      times = array('d', (start + i * interval for i in range(n_samples)))
+      circuit.results[key] = (times, _waveform(f"{data_path}|{dataset}", times))
+   times, values = circuit.results[key]
+
+   # The arrays keep their memory alive for as long as the buffer exists
+   sampling_buffer = (ctypes.c_double * n_samples).from_buffer(times)
+   values_buffer = (ctypes.c_double * n_samples).from_buffer(values)
+   buffer_id = str(next(_buffer_ids))
+   _buffers[buffer_id] = (sampling_buffer, values_buffer)
+
+   def address(buffer) -> str:
+      return base64.b64encode(struct.pack('P', ctypes.addressof(buffer))).decode()
+
+   return (f"<buffer><id>{buffer_id}</id>"
+           f"<values><length>{n_samples}</length><addr>{address(values_buffer)}</addr></values>"
+           f"<sampling-values><length>{n_samples}</length><addr>{address(sampling_buffer)}</addr></sampling-values>"
+           f"</buffer>")
+
+
+def _sampling(circuit: _Circuit) -> tuple:
+   start = float(circuit.run_parameters["start_time_s"])
+   stop = float(circuit.run_parameters["stop_time_s"])
+   interval = float(circuit.run_parameters["interval_s"])
+   return start, interval, int(round((stop - start) / interval)) + 1
+
+
+def _wait_for_simulation_end(circuit_name: str) -> str:
+   with _lock:
+      circuit = _circuit(circuit_name)
+      remaining = circuit.run_end - time.perf_counter() if _is_running(circuit) else 0
+
+   # Other threads keep using the API while this one waits
+   if remaining > 0:
+      time.sleep(remaining)
+   return "ok" if not circuit.stopped else "stopped"
+
+
+def get(target: str) -> str:
+   path, command, arguments = _split(target)
+   _wait(command)
+   if command == "prop=wait_for_simulation_end" and path:
+      with _lock:
+         _count("get", command)
+      return _wait_for_simulation_end(path[0])
+
+   with _lock:
+      _count("get", command)
+
+      if command == "prop=ame_version":
+         return ("<version><major-version>2310</major-version><update-version>0</update-version>"
+                 "<hotfix-version>0</hotfix-version><version-string>2310 (fake afp)</version-string></version>")
+      if command == "prop=open_circuits":
+         names = "".join(f"<circuit><circuit-name>{name}</circuit-name></circuit>" for name in _circuits)
+         return f"<circuits>{names}</circuits>"
+      if not path:
+         raise AccessError(f"Unsupported request: {target}")
+
+      circuit = _circuit(path[0])
+      if command == "prop=mode":
+         return str(circuit.mode)
+      if command == "prop=simulation_running":
+         return "1" if _is_running(circuit) else "0"
+      if command == "prop=run_parameter":
+         return circuit.run_parameters.get(arguments.get("run_parameter_name"))
+      if command == "cmd=ame_get_batch_last_run":
+         return ""
+      if command == "data_value" and len(path) == 2:
+         return circuit.parameters.get(path[1], "0")
+      if command == "data_unit" and len(path) == 2:
+         return ""
+      if command == "cmd=create_variable_results_buffer" and len(path) == 2:
+         return _create_results_buffer(circuit, path[1], arguments.get("dataset", "ref"))
+      return ""
+
+
+def _set_json(command: str, args: dict) -> str:
+   if command == "data_value":
+      data_path, _, circuit_name = args["data_path"].rpartition(':')
+      _circuit(circuit_name).parameters[data_path] = args["value"]
+   elif command == "set_run_parameter":
+      _circuit(args["circuit"]).run_parameters[args["parameter_name"]] = args["value"]
+   elif command in ("add_component", "add_dyn_component"):
+      _circuit(args["circuit"]).components.append(args["alias"])
+   return ""
+
+
+def set(target: str, value: str) -> str:
+   path, command, arguments = _split(target)
+   _wait(command)
+   with _lock:
+      _count("set", command)
+
+      if command == "cmd=create_circuit":
+         return open_circuit()
+      if command == "cmd=destroy_variable_results_buffer":
+         _buffers.pop(arguments.get("id"), None)
+         return ""
+      if not path:
+         # _AME commands send their arguments as JSON, others are accepted as is
+         if value.startswith('{'):
+            return _set_json(command, json.loads(value))
+         return ""
+
+      circuit = _circuit(path[0])
+      if command == "prop=mode":
+         if value in MODES:
+            circuit.mode = MODES.index(value)
+         return ""
+      if command == "cmd=start_simulation":
+         if circuit.mode != SIMULATION_MODE_INDEX:
+            raise AccessError(f"Circuit '{circuit.name}' must be in simulation mode to start a simulation")
+         circuit.run_end = time.perf_counter() + simulation_s
+         circuit.stopped = False
+         circuit.has_results = True
+         circuit.sampling = _sampling(circuit)
+         circuit.results = {}
+         return ""
+      if command == "cmd=stop_simulation":
+         if _is_running(circuit):
+            circuit.stopped = True
+         return ""
+      return ""
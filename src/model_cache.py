@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import importlib.util
+import io
+import marshal
+import os
+import sys
+import tempfile
+from types import CodeType
+from typing import Callable
+
+from amesim_model import AmesimModel
+
+##############################################################################################
+
+
+class ModelCache:
+   """Cache of the trimmed and compiled code, or the parsed AmesimModel, of model scripts.
+
+   In memory, entries are looked up by path, modification time and size, so an unchanged file
+   is not even read again, and then by a hash of the source. With disk_cache, entries are
+   also stored in a __pycache__ directory next to the model so new processes skip parsing.
+   """
+
+   def __init__(self, disk_cache: bool = False):
+      self.disk_cache = disk_cache
+      self._by_stat = {}
+      self._by_hash = {}
+
+
+   def load(self, model_file: str, trim: Callable[[str], str]) -> CodeType:
+      """Return the compiled code of model_file after trim, compiling it only on a cache miss"""
+      return self._load(model_file, "code",
+                        lambda text, path: compile(trim(text), path, "exec"),
+                        marshal.dumps, marshal.loads)
+
+
+   def load_parsed(self, model_file: str, trim: Callable[[str], str]) -> AmesimModel:
+      """Return model_file after trim parsed into an AmesimModel, parsing it only on a cache miss"""
+      return self._load(model_file, "model",
+                        lambda text, path: AmesimModel.parse(trim(text)),
+                        AmesimModel.dumps, AmesimModel.loads)
+
+
+   def _load(self, model_file: str, kind: str, build: Callable, dumps: Callable, loads: Callable):
+      path = os.path.abspath(model_file)
+      stat = os.stat(path)
+      stat_key = (kind, path, stat.st_mtime_ns, stat.st_size)
+      if stat_key in self._by_stat:
+         return self._by_stat[stat_key]
+
+      with open(path, "rb") as file:
+         source = file.read()
+      source_hash = hashlib.sha256(source).hexdigest()
+      hash_key = (kind, source_hash)
+
+      entry = self._by_hash.get(hash_key)
+      if entry is None and self.disk_cache:
+         entry = self._read_disk(path, kind, source_hash, loads)
+      if entry is None:
+         # Decode the same way open(model_file, "r") does
+         text = io.TextIOWrapper(io.BytesIO(source)).read()
+         entry = build(text, path)
+         if self.disk_cache:
+            self._write_disk(path, kind, source_hash, dumps(entry))
+
+      self._by_hash[hash_key] = entry
+      self._by_stat[stat_key] = entry
+      return entry
+
+
+   @staticmethod
+   def _disk_path(path: str, kind: str, source_hash: str) -> str:
+      stem = os.path.splitext(os.path.basename(path))[0]
+      file_name = f"{stem}.{source_hash[:16]}.{sys.implementation.cache_tag}.amesim-{kind}"
+      return os.path.join(os.path.dirname(path), "__pycache__", file_name)
+
+
+   @staticmethod
+   def _header(source_hash: str) -> bytes:
+      # Bytecode magic number, marshal data is only readable by the same Python version
+      return importlib.util.MAGIC_NUMBER + bytes.fromhex(source_hash)
+
+
+   def _read_disk(self, path: str, kind: str, source_hash: str, loads: Callable):
+      try:
+         with open(self._disk_path(path, kind, source_hash), "rb") as file:
+            data = file.read()
+      except OSError:
+         return None
+
+      header = self._header(source_hash)
+      if not data.startswith(header):
+         return None
+      try:
+         return loads(data[len(header):])
+      except (EOFError, ValueError, TypeError):
+         return None
+
+
+   def _write_disk(self, path: str, kind: str, source_hash: str, data: bytes) -> None:
+      cache_path = self._disk_path(path, kind, source_hash)
+      cache_dir = os.path.dirname(cache_path)
+      try:
+         os.makedirs(cache_dir, exist_ok=True)
+
+         # Entries of older versions of this model are never used again
+         stem = os.path.splitext(os.path.basename(path))[0]
+         for old_path in glob.glob(os.path.join(cache_dir, f"{glob.escape(stem)}.*.amesim-{kind}")):
+            if old_path != cache_path:
+               os.remove(old_path)
+
+         fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+         with os.fdopen(fd, "wb") as file:
+            file.write(self._header(source_hash) + data)
+         os.replace(temp_path, cache_path)
+      except OSError as exc:
+         # The cache is only an optimization, e.g. the model directory may be read-only
+         print(f"Unable to write model cache {cache_path}: {exc}")
+
+
+# Shared by every SimulationService in the process
+default_model_cache = ModelCache()
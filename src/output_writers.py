@@ -0,0 +1,94 @@
+import csv
+from typing import Dict, Sequence
+
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+##############################################################################################
+
+# Rows formatted and written per block, this bounds the temporary memory used by the writers
+DEFAULT_CHUNK_SIZE = 65536
+
+# "%r" writes the shortest representation that reads back to the same float
+DEFAULT_FLOAT_FORMAT = "%r"
+
+
+def _row_block(columns: Sequence[Sequence[float]], start: int, stop: int) -> list:
+   """Flatten rows start..stop of the columns into one row-major list of floats"""
+   if np is not None:
+      return np.column_stack([column[start:stop] for column in columns]).ravel().tolist()
+   return [value for row in zip(*(column[start:stop] for column in columns)) for value in row]
+
+
+def write_csv(output_path: str, columns: Dict[str, Sequence[float]],
+              float_format: str = DEFAULT_FLOAT_FORMAT, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+   """Write equal length columns to a CSV file with a header row.
+
+   Rows are formatted a block of chunk_size at a time with a single % operation,
+   float_format is any printf style format for one float (e.g. "%.6g").
+   """
+   names = list(columns.keys())
+   data = list(columns.values())
+   n_rows = len(data[0]) if data else 0
+
+   # Same line terminator as csv.writer, so files don't change with the writer
+   line_format = ",".join([float_format] * len(data)) + "\r\n"
+
+   with open(output_path, 'w', newline='', buffering=1024 * 1024) as csvfile:
+      csv.writer(csvfile).writerow(names)
+
+      for start in range(0, n_rows, chunk_size):
+         stop = min(start + chunk_size, n_rows)
+         block = _row_block(data, start, stop)
+         csvfile.write((line_format * (stop - start)) % tuple(block))
+
+
+def write_npz(output_path: str, columns: Dict[str, Sequence[float]]) -> None:
+   """Write the columns to a compressed NumPy .npz archive, one array per column"""
+   if np is None:
+      raise ImportError("Error: NumPy is required for the npz output format")
+   np.savez_compressed(output_path, **{name: np.asarray(column, dtype=np.float64) for name, column in columns.items()})
+
+
+def _arrow_table(columns: Dict[str, Sequence[float]]):
+   import pyarrow as pa
+
+   arrays = []
+   for column in columns.values():
+      if np is not None:
+         arrays.append(pa.array(np.asarray(column, dtype=np.float64)))
+      else:
+         arrays.append(pa.array(column.tolist(), type=pa.float64()))
+   return pa.table(arrays, names=list(columns.keys()))
+
+
+def write_parquet(output_path: str, columns: Dict[str, Sequence[float]]) -> None:
+   """Write the columns to a zstd compressed Parquet file"""
+   try:
+      import pyarrow.parquet as pq
+   except ImportError:
+      raise ImportError("Error: pyarrow is required for the parquet output format")
+   pq.write_table(_arrow_table(columns), output_path, compression="zstd")
+
+
+def write_arrow(output_path: str, columns: Dict[str, Sequence[float]]) -> None:
+   """Write the columns to an uncompressed Arrow IPC file, which readers can memory-map"""
+   try:
+      import pyarrow as pa
+   except ImportError:
+      raise ImportError("Error: pyarrow is required for the arrow output format")
+   table = _arrow_table(columns)
+   with pa.OSFile(output_path, 'wb') as sink:
+      with pa.ipc.new_file(sink, table.schema) as writer:
+         writer.write_table(table)
+
+
+# Output format name -> (file name, writer)
+OUTPUT_FORMATS = {
+   "csv": ("data.csv", write_csv),
+   "npz": ("data.npz", write_npz),
+   "parquet": ("data.parquet", write_parquet),
+   "arrow": ("data.arrow", write_arrow),
+}
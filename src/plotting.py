@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import Executor
+from typing import Dict, List, Sequence, Tuple
+
+##############################################################################################
+
+# matplotlib and NumPy are imported inside the functions so importing this module stays cheap
+
+
+def decimate_minmax(time_values: Sequence[float], variable_values: Sequence[float],
+                    n_bins: int) -> Tuple[Sequence[float], Sequence[float]]:
+   """Reduce a series to the min and max of n_bins equal buckets, keeping the first and last points.
+
+   The min/max envelope looks the same as the full series when a bucket is about one pixel
+   wide, so peaks are not lost the way they are with plain striding. Short series are
+   returned unchanged.
+   """
+   import numpy as np
+
+   time_values = np.asarray(time_values)
+   variable_values = np.asarray(variable_values)
+   n_samples = len(variable_values)
+   if n_bins <= 0 or n_samples <= 2 * n_bins:
+      return time_values, variable_values
+
+   bucket_size = -(-n_samples // n_bins)
+   n_full = (n_samples // bucket_size) * bucket_size
+   buckets = variable_values[:n_full].reshape(-1, bucket_size)
+   offsets = np.arange(0, n_full, bucket_size)
+   indices = [offsets + np.argmin(buckets, axis=1), offsets + np.argmax(buckets, axis=1)]
+
+   # Samples left over after the last full bucket form one more bucket
+   if n_full < n_samples:
+      tail = variable_values[n_full:]
+      indices.append(np.array([n_full + np.argmin(tail), n_full + np.argmax(tail)]))
+
+   indices = np.unique(np.concatenate(indices + [np.array([0, n_samples - 1])]))
+   return time_values[indices], variable_values[indices]
+
+
+def _plot_figure(time_values: Sequence[float], variable_values: Sequence[float],
+                 variable_name: str, decimate: bool):
+   from matplotlib.figure import Figure
+
+   figure = Figure()
+   if decimate:
+      width_px = int(figure.get_figwidth() * figure.dpi)
+      time_values, variable_values = decimate_minmax(time_values, variable_values, width_px)
+
+   axes = figure.add_subplot()
+   axes.plot(time_values, variable_values, label=variable_name)
+   axes.legend(loc="upper left")
+   axes.set_xlabel("Time")
+   axes.set_ylabel(variable_name)
+   axes.grid(True)
+   return figure
+
+
+def render_plot_pdf(time_values: Sequence[float], variable_values: Sequence[float],
+                    variable_name: str, output_path: str, decimate: bool = True) -> str:
+   """Plot one variable over time to a PDF on its own Figure, independent of the pyplot state"""
+   figure = _plot_figure(time_values, variable_values, variable_name, decimate)
+   figure.savefig(output_path)
+   return output_path
+
+
+def _figure_width_px() -> int:
+   import matplotlib
+   return int(matplotlib.rcParams["figure.figsize"][0] * matplotlib.rcParams["figure.dpi"])
+
+
+def render_plots_pdf(outputs: Dict[str, Sequence[float]], variable_names: List[str],
+                     output_dir: str, executor: Executor = None, decimate: bool = True) -> List[str]:
+   """Render {variable_name}.pdf for each variable in output_dir, in parallel on executor if given.
+
+   outputs is a columnar table as returned by SimulationService.get_outputs. The executor is
+   kept by the caller across calls, so its worker processes start and import matplotlib once.
+   Returns the paths of the PDF files.
+   """
+   import numpy as np
+
+   # memoryviews can't be sent to worker processes
+   time_values = np.asarray(outputs["time"])
+   jobs = []
+   for variable_name in variable_names:
+      job_time, job_values = time_values, np.asarray(outputs[variable_name])
+      # Decimated here, each job only sends about two points per pixel instead of every sample
+      if decimate:
+         job_time, job_values = decimate_minmax(job_time, job_values, _figure_width_px())
+      jobs.append((job_time, job_values, variable_name, os.path.join(output_dir, f"{variable_name}.pdf"), False))
+
+   # Sending the job is not worth it for a single plot
+   if executor is None or len(jobs) <= 1:
+      return [render_plot_pdf(*job) for job in jobs]
+
+   futures = [executor.submit(render_plot_pdf, *job) for job in jobs]
+   return [future.result() for future in futures]
+
+
+def render_plots_multipage_pdf(outputs: Dict[str, Sequence[float]], variable_names: List[str],
+                               output_path: str, decimate: bool = True) -> str:
+   """Render all variables into one PDF file, one page per variable"""
+   from matplotlib.backends.backend_pdf import PdfPages
+
+   with PdfPages(output_path) as pdf:
+      for variable_name in variable_names:
+         pdf.savefig(_plot_figure(outputs["time"], outputs[variable_name], variable_name, decimate))
+   return output_path
@@ -1,8 +1,19 @@
-import csv
+import array
+import itertools
 import json
-import matplotlib.pyplot as plt
+import multiprocessing.util
 import os
-from typing import List, Tuple
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from model_cache import default_model_cache
+from output_writers import DEFAULT_FLOAT_FORMAT, OUTPUT_FORMATS, write_csv
+from plotting import decimate_minmax, render_plot_pdf, render_plots_multipage_pdf, render_plots_pdf
+from table_store import TableStore
+from time_series import load_time_series
+from tracing import Tracer, traced
 
 try:
     from amesim import *
@@ -16,35 +27,197 @@ try:
 except ImportError:
   print('Unable to import Simcenter Amesim API module.\nCheck the AME environment variable.')
 
+try:
+  import afp
+except ImportError:
+  afp = None
+
+try:
+  from ame_apy import AMEGetVariableArrays
+except ImportError:
+  # Older API modules only return (time, value) pairs
+  AMEGetVariableArrays = None
+
+try:
+  from ame_apy import AMESetParameterValues
+except ImportError:
+  # Older API modules only set one parameter per call
+  AMESetParameterValues = None
+
+try:
+  from ame_apy import AMEEnableModeCache, AMEInvalidateModeCache
+except ImportError:
+  # Older API modules query the circuit mode before every call
+  AMEEnableModeCache = None
+  AMEInvalidateModeCache = None
+
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+##############################################################################################
+
+# Interval between checks for finished simulations in run_parallel, doubled while none finishes
+POLL_MIN_S = 0.01
+POLL_MAX_S = 0.5
+
+# Fewer plots are rendered in this process, faster than worker processes start and import matplotlib
+PARALLEL_PLOTS_MIN = 4
+
+# Service settings a config can set, each one named as its key in the config
+CONFIG_SETTINGS = ("structured_model", "csv_float_format", "output_format", "plot_workers", "decimate_plots",
+                   "single_pdf", "mode_cache", "parallel_circuits", "trace_report", "chrome_trace")
+
+
+def _as_float_array(values):
+   """Copy a sequence of floats into a contiguous float64 array (a memoryview of doubles without NumPy)"""
+   if np is not None:
+      return np.asarray(values, dtype=np.float64)
+   return memoryview(array.array('d', values))
+
+def _parameter_text(value) -> str:
+   # Parameter values are sent to Amesim as text, compare them the same way
+   return str(value) if value is not None else ""
+
+
+def _check_parameter_path(param_name: str) -> None:
+   # Same rules as AMESetParameterValues: name[@element][:circuit]
+   if (not isinstance(param_name, str) or param_name.count(":") > 1 or param_name.count("@") > 1
+         or not param_name.split(":")[0].split("@")[0]):
+      raise ValueError(f"Error: Invalid parameter path '{param_name}'")
+
+
+def write_output_data(outputs: Dict[str, Sequence[float]], output_path: str, output_format: str = "csv",
+                      float_format: str = DEFAULT_FLOAT_FORMAT) -> str:
+   """Save columnar outputs, as returned by get_outputs, to output_path/data.<format> and return its path"""
+   file_name, writer = OUTPUT_FORMATS[output_format]
+   os.makedirs(output_path, exist_ok=True)
+   file_path = os.path.join(output_path, file_name)
+
+   print(f"Saving output data to {file_path}")
+   if output_format == "csv":
+      write_csv(file_path, outputs, float_format)
+   else:
+      writer(file_path, outputs)
+   return file_path
+
+
+def write_output_plots(outputs: Dict[str, Sequence[float]], variable_names: List[str], output_path: str,
+                       decimate: bool = True, single_pdf: bool = False, executor=None) -> None:
+   """Save the plots of columnar outputs to output_path, one PDF per variable rendered on executor
+   (in this process without one), or all of them as pages of plots.pdf with single_pdf"""
+   os.makedirs(output_path, exist_ok=True)
+   if single_pdf:
+      render_plots_multipage_pdf(outputs, variable_names, os.path.join(output_path, "plots.pdf"), decimate)
+   else:
+      render_plots_pdf(outputs, variable_names, output_path, executor, decimate)
+
+
+def save_output_files(outputs: Dict[str, Sequence[float]], variable_names: List[str], output_path: str,
+                      output_format: str = "csv", float_format: str = DEFAULT_FLOAT_FORMAT, decimate: bool = True,
+                      single_pdf: bool = False, plot_executor=None) -> None:
+   """Save the data file and plots of a run from its outputs alone, as SimulationService.save_all_output_files does.
+   Needs no API call, so it can run in any thread."""
+   write_output_data(outputs, output_path, output_format, float_format)
+   write_output_plots(outputs, variable_names, output_path, decimate, single_pdf, plot_executor)
+
+
+def _has_display() -> bool:
+   """Whether interactive plot windows can be shown"""
+   if sys.platform.startswith("linux"):
+      return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+   return True
+
 ##############################################################################################
 
 class SimulationService:
-   def __init__(self):
+   def __init__(self, headless: bool = None, session: bool = False, trace_report: str = None,
+                chrome_trace: str = None):
+      # Timings of each stage of the runs, see trace_report and chrome_trace. Tracing enabled
+      # here also records the API initialization, unlike tracing enabled by a config
+      self.tracer = Tracer()
+      self.trace_report = trace_report
+      self.chrome_trace = chrome_trace
+      self._install_tracer()
+
       self._initialize_amesim()
 
-      # Temporary files are generated when running from config file
-      self.temp_files = []
+      # In session mode the circuit stays open after an experiment, and the next experiment
+      # on the same model only sends the parameters that changed
+      self.session = session
+
+      # Model whose circuit is open, its parameter values without overrides (those of the script,
+      # and those read from Amesim of the other parameters overridden since it was built),
+      # the values it was loaded with, and the last value sent for each parameter
+      self._open_model = None
+      self._model_defaults = None
+      self._base_parameters = {}
+      self._parameter_values = {}
+
+      # Headless mode never opens plot windows; by default it is on when there is no display.
+      # A value given here (e.g. --headless) wins over the config's
+      self._headless_from_config = headless is None
+      if headless is None:
+         headless = not _has_display()
+      self.headless = headless
+
+      # Compiled model scripts, shared with the other services in this process
+      self.model_cache = default_model_cache
+
+      # Build models by replaying their parsed API calls instead of running the script
+      self.structured_model = False
+
+      # Time-series table files, shared with other runs and worker processes on this machine
+      self.table_store = TableStore()
+
+      # Output values of the last run, keyed by (variable name, dataset)
+      self._output_cache = {}
+
+      # printf style format of the values in data.csv
+      self.csv_float_format = DEFAULT_FLOAT_FORMAT
+
+      # Format of the output data file: csv, npz, parquet or arrow
+      self.output_format = "csv"
+
+      # Worker processes used to render PDF plots, None uses every core.
+      # They are started on the first plots and kept until quit
+      self.plot_workers = None
+      self._plot_executor = None
+      self._plot_executor_workers = 0
 
+      # Plot the min/max envelope at about one point per pixel instead of every sample
+      self.decimate_plots = True
 
+      # Save all plots as pages of one plots.pdf instead of one PDF per variable
+      self.single_pdf = False
+
+      # Remember the mode of each circuit instead of querying it before every API call
+      self.mode_cache = False
+
+      # Circuits simulating a sweep at the same time, see run_parallel
+      self.parallel_circuits = 1
+
+      # Last runtime parameters set, also used for the extra circuits of run_parallel
+      self._runtime_parameters = None
+
+      # Settings as constructed, see _apply_config_settings
+      self._setting_defaults = self._settings()
+
+
+   @traced("init")
    def _initialize_amesim(self) -> None:
       AMEInitAPI(False)
       AMEGetAPIVersion()
 
 
-   def _create_temporary_file(self, time_col, data_col, file_name):
-        # Get the full path for the file in the working directory
-        file_path = os.path.join(os.getcwd(), file_name)  
-        self.temp_files.append(file_path)
-        with open(file_path, 'w', newline='') as temp_data_file:
-            csv_writer = csv.writer(temp_data_file, delimiter=' ')
-            for row in zip(time_col, data_col):
-                csv_writer.writerow(row)
-
-
-   def _delete_temporary_files(self):
-        for file_path in self.temp_files:
-            os.remove(file_path)
-        self.temp_files = []
+   def _pyplot(self):
+      """Import pyplot on first use, so runs that don't plot never load matplotlib"""
+      import matplotlib
+      if self.headless:
+         matplotlib.use("Agg", force=True)
+      import matplotlib.pyplot as plt
+      return plt
 
 
    def _trim_amesim_model(self, code: str) -> str:
@@ -68,42 +241,178 @@ class SimulationService:
       return trimmed_code
 
 
-   def load_model(self, model_file: str) -> None:
+   @traced("load_model")
+   def load_model(self, model_file: str, parameters: Dict[str, str] = None, new_circuit: bool = False) -> None:
+      """Build the model from the Amesim-generated script, then set parameters (name -> value).
+
+      With structured_model the script is parsed into its API calls and replayed, and
+      parameters replace the script's values so each parameter is only set once. Parameters
+      the script doesn't set are set once the model is built.
+      With new_circuit the model is always built as a new circuit, and the circuit that was
+      open stays open (e.g. still running) instead of being reused or closed.
+      """
       print(f"Loading model: {model_file}")
       file_extension = model_file.split('.')[-1]
       if file_extension.lower() != "py":
          raise ValueError("Error: Model file must have correct file extension: .py")
       
-      with open(model_file, "r") as file:
-         code = file.read()
+      self._output_cache = {}
+
+      model_key = self._model_key(model_file)
+      if not new_circuit:
+         if self.session and model_key == self._open_model and self._model_defaults is not None:
+            print("Model is already open, only updating changed parameters")
+            self._update_parameters(parameters)
+            return
+         if self._open_model is not None:
+            self._close_circuit()
+      self._open_model = None
 
+      model = None
       try:
-         exec(self._trim_amesim_model(code))
+         if self.structured_model:
+            try:
+               model = self.model_cache.load_parsed(model_file, self._trim_amesim_model)
+            except (ValueError, SyntaxError) as exc:
+               print(f"Unable to parse model, running the script instead: {exc}")
+
+         if model is not None:
+            script_parameters = {name: value for name, value in (parameters or {}).items() if name in model.parameters}
+            if script_parameters:
+               print(f"Setting {len(script_parameters)} parameters while building the model")
+            values = model.replay(globals(), script_parameters)
+            self._parameter_values = {name: _parameter_text(value) for name, value in values.items()}
+            # Copied, the parsed model is shared through the model cache
+            self._model_defaults = dict(model.parameters)
+         else:
+            exec(self.model_cache.load(model_file, self._trim_amesim_model))
       except:
          print("Error loading model")
          raise
+      self._open_model = model_key
+
+      if model is None:
+         self._model_defaults = self._script_parameters(model_file)
+         self._parameter_values = {name: _parameter_text(value) for name, value in (self._model_defaults or {}).items()}
+      if parameters:
+         # Those already set by the replay are unchanged and not sent again
+         self.set_model_parameters(parameters)
+      self._base_parameters = dict(self._model_defaults or {})
+      self._base_parameters.update(parameters or {})
+
+
+   @staticmethod
+   def _model_key(model_file: str) -> tuple:
+      stat = os.stat(model_file)
+      return (os.path.abspath(model_file), stat.st_mtime_ns, stat.st_size)
+
+
+   def _script_parameters(self, model_file: str) -> Dict[str, str]:
+      """Parameter values set by the model script, None if the script can't be parsed"""
+      try:
+         return dict(self.model_cache.load_parsed(model_file, self._trim_amesim_model).parameters)
+      except (ValueError, SyntaxError):
+         return None
+
+
+   def _update_parameters(self, parameters: Dict[str, str] = None) -> None:
+      """Bring the open model to its values without overrides with parameters applied, sending only changes"""
+      target = dict(self._model_defaults)
+      if parameters:
+         target.update(parameters)
+      self.set_model_parameters(target)
+      # The model values of parameters overridden for the first time were added
+      self._base_parameters = dict(self._model_defaults)
+      self._base_parameters.update(parameters or {})
 
 
-   def set_model_parameter(self, param_name: str, param_value: str) -> None:
-      """Set the parameter values for the component"""
+   def _record_model_values(self, param_names) -> None:
+      """Read the model value of parameters the script doesn't set before they are first changed,
+      so the next experiment on the open model can put them back"""
+      if self._model_defaults is None:
+         # The circuit is built again for every experiment
+         return
+      for param_name in param_names:
+         if param_name not in self._model_defaults:
+            value = AMEGetParameterValue(param_name)[0]
+            self._model_defaults[param_name] = value
+            self._parameter_values.setdefault(param_name, value)
+
+
+   @traced("set_parameters")
+   def set_model_parameter(self, param_name: str, param_value: str, force: bool = False) -> None:
+      """Set the parameter values for the component.
+      Nothing is sent when param_value is the last value set for the parameter, unless force is set."""
+      value = _parameter_text(param_value)
+      if not force and self._parameter_values.get(param_name) == value:
+         return
+
       print(f"Setting parameter: {param_name} = {param_value}")
       try:
+         self._record_model_values([param_name])
          AMESetParameterValue(param_name, param_value)
       except:
+         # The value in Amesim is unknown now, send it again next time
+         self._parameter_values.pop(param_name, None)
          print("Error setting model parameter")
          raise
+      self._parameter_values[param_name] = value
+
 
+   @traced("set_parameters")
+   def set_model_parameters(self, parameters: Dict[str, str], force: bool = False) -> None:
+      """Set several parameter values (name -> value) at once.
+      As with set_model_parameter, values that haven't changed are not sent unless force is set."""
+      changed = {
+         param_name: value for param_name, value in parameters.items()
+         if force or self._parameter_values.get(param_name) != _parameter_text(value)
+      }
+      if not changed:
+         return
 
+      if AMESetParameterValues is None:
+         # AMESetParameterValues checks every path before setting anything, do the same here so
+         # a bad path doesn't leave the model with only some of the values
+         for param_name in changed:
+            _check_parameter_path(param_name)
+
+      print(f"Setting {len(changed)} parameters ({len(parameters) - len(changed)} unchanged)")
+      try:
+         self._record_model_values(changed)
+         if AMESetParameterValues is not None:
+            AMESetParameterValues(changed)
+         else:
+            for param_name, value in changed.items():
+               AMESetParameterValue(param_name, value)
+      except:
+         # Some values may not have been set, send them all again next time
+         for param_name in changed:
+            self._parameter_values.pop(param_name, None)
+         print("Error setting model parameters")
+         raise
+      for param_name, value in changed.items():
+         self._parameter_values[param_name] = _parameter_text(value)
+
+
+   @traced("set_parameters")
    def set_model_parameter_timeseries(self, table_name: str, data_file: str) -> None:
       """Data table file must be .csv, .txt, or .data"""
 
-      file_extension = data_file.split('.')[-1]
+      file_extension = os.path.splitext(data_file)[1]
       if file_extension.lower() not in [".csv", ".txt", ".data"]: 
          raise ValueError(f"{file_extension}: Data file must have correct file extension: .csv, .txt, .data")
       param_name = f"filename@{table_name}"
       self.set_model_parameter(param_name, data_file)
 
 
+   @traced("set_parameters")
+   def set_model_parameter_timeseries_data(self, table_name: str, time_col, data_col) -> None:
+      """Set a time-series table from its columns, reusing the stored file if the table was seen before"""
+      data_file = self.table_store.resolve(time_col, data_col)
+      self.set_model_parameter_timeseries(table_name, data_file)
+
+
+   @traced("set_parameters")
    def set_runtime_parameters(self, start_time_s: str, stop_time_s:str, interval_s: str) -> None:
 
       print(f"Setting runtime parameters: start={start_time_s}, stop={stop_time_s}, interval={interval_s}")
@@ -115,46 +424,112 @@ class SimulationService:
       except:
          print("Error setting runtime parameters")
          raise
+      self._runtime_parameters = (start_time_s, stop_time_s, interval_s)
 
 
-   def _parse_config_file(self, config_file: str) -> dict:
+   @staticmethod
+   def _parse_config_file(config_file: str) -> dict:
       with open(config_file, 'r') as file:
          data = json.load(file)
 
-         required_keys = [
-         "model_file", "start_time_s", "end_time_s", 
-         "interval_s", "parameters", "outputs", 
-         "generate_output_files"
-         ]
-         for key in required_keys:
-            if key not in data:
-               raise RuntimeError(f"Error: '{key}' is missing in the JSON config file ")
+         SimulationService._check_config(data)
             
          return data
 
 
+   @staticmethod
+   def _check_config(data: dict) -> None:
+      required_keys = [
+      "model_file", "start_time_s", "end_time_s", 
+      "interval_s", "parameters", "outputs", 
+      "generate_output_files"
+      ]
+      for key in required_keys:
+         if key not in data:
+            raise RuntimeError(f"Error: '{key}' is missing in the JSON config file ")
+
+
+   @traced("set_parameters")
+   def _config_parameter_values(self, data: dict) -> Dict[str, str]:
+      """Model parameter values set by the config, with time-series tables as their data files"""
+      # Constant parameters
+      parameters = {param_name: str(value) for param_name, value in data["parameters"].items()}
+
+      # Timeseries parameters
+      for table_name, table_spec in data["time_series_data"].items():
+         time_col, data_col = load_time_series(table_name, table_spec)
+         
+         parameters[f"filename@{table_name}"] = self.table_store.resolve(time_col, data_col)
+
+      return parameters
+
+
+   @staticmethod
+   def _expand_sweep(sweep: dict) -> List[dict]:
+      """Expand a sweep config section into a list of parameter sets.
+
+      "grid" maps parameter names to lists of values and produces every combination,
+      "sets" is an explicit list of parameter name/value objects.
+      """
+      if "sets" in sweep:
+         return [dict(parameter_set) for parameter_set in sweep["sets"]]
+      if "grid" in sweep:
+         names = list(sweep["grid"].keys())
+         values = [sweep["grid"][name] for name in names]
+         return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+      raise RuntimeError("Error: 'sweep' must contain either 'grid' or 'sets' in the JSON config file")
+
+
    def run_from_config_file(self, config_file: str) -> None:
 
       print(f"Running from config file: {config_file}")
 
       data = self._parse_config_file(config_file)
 
-      # Load model
-      self.load_model(data["model_file"])
-   
-      # Set constant parameters
-      for param_name, value in data["parameters"].items():
-         self.set_model_parameter(param_name, str(value))
-
-      # Set timeseries parameters
-      for table_name, values_dict in data["time_series_data"].items():
-         time_col = values_dict.keys()
-         data_col = values_dict.values()
-         
-         # Create a temporary file containing timeseries data
-         file_name = f"{table_name}.txt"
-         self._create_temporary_file(time_col, data_col, file_name)
-         self.set_model_parameter_timeseries(table_name, file_name)
+      self.run_from_config(data)
+
+
+   def _settings(self) -> dict:
+      settings = {name: getattr(self, name) for name in CONFIG_SETTINGS}
+      settings["headless"] = self.headless
+      settings["model_disk_cache"] = self.model_cache.disk_cache
+      return settings
+
+
+   def _apply_config_settings(self, data: dict, reset: bool = False) -> None:
+      """Take the service options of a parsed config, keeping the current value of those it doesn't set.
+      With reset they go back to their value at construction instead, for configs that must not
+      depend on the ones run before them."""
+      current = self._setting_defaults if reset else self._settings()
+      for name in CONFIG_SETTINGS:
+         setattr(self, name, data.get(name, current[name]))
+      if self._headless_from_config:
+         self.headless = data.get("headless", current["headless"])
+      self.model_cache.disk_cache = data.get("model_disk_cache", current["model_disk_cache"])
+      if self.output_format not in OUTPUT_FORMATS:
+         raise RuntimeError(f"Error: 'output_format' must be one of {', '.join(OUTPUT_FORMATS)} in the JSON config file")
+
+      if AMEEnableModeCache is not None:
+         AMEEnableModeCache(self.mode_cache)
+
+      self._install_tracer()
+
+
+   def _install_tracer(self) -> None:
+      # Record the afp calls under the stage that made them
+      if (self.trace_report or self.chrome_trace) and afp is not None:
+         self.tracer.keep_events = self.tracer.keep_events or bool(self.chrome_trace)
+         self.tracer.install(afp)
+
+
+   def run_from_config(self, data: dict, reset_settings: bool = False) -> None:
+      """Run an experiment from an already parsed config.
+      With reset_settings, the settings the config doesn't set are not those of the previous config."""
+
+      self._apply_config_settings(data, reset_settings)
+
+      # Load model with the config's parameters
+      self.load_model(data["model_file"], self._config_parameter_values(data))
 
       # Set runtime parameters
       self.set_runtime_parameters(
@@ -162,22 +537,374 @@ class SimulationService:
          str(data["end_time_s"]),
          str(data["interval_s"]),
       )
-      
+
+      if "sweep" in data and "batch" in data:
+         raise RuntimeError("Error: 'sweep' and 'batch' cannot both be used in the JSON config file")
+
+      # Amesim batch: all runs are done by the solver in a single simulation
+      if "batch" in data:
+         output_path = None
+         if data["generate_output_files"]:
+            output_path = os.path.join(os.getcwd(), "output")
+         self.set_batch(data["batch"]["type"], data["batch"]["parameters"])
+         self.run_batch(data["outputs"], output_path)
+         self._end_experiment()
+         return
+
+      # Parameter sweep: the model stays loaded and only the swept parameters change per run
+      if "sweep" in data:
+         output_path = None
+         if data["generate_output_files"]:
+            output_path = os.path.join(os.getcwd(), "output")
+         parameter_sets = self._expand_sweep(data["sweep"])
+         first_run = data["sweep"].get("first_run", 0)
+         if self.parallel_circuits > 1:
+            self.run_parallel(parameter_sets, data["outputs"], self.parallel_circuits, output_path, first_run)
+         else:
+            self.run_sweep(parameter_sets, data["outputs"], output_path, first_run)
+         self._end_experiment()
+         return
+
       self.run_simulation()
 
-      # Get output data and save to files
-      for output_param in data["outputs"]:
-         self.plot_variable(output_param)
+      # Display output plots, nobody would see them in headless mode
+      if not self.headless:
+         for output_param in data["outputs"]:
+            self.plot_variable(output_param)
 
       # Possibly save outputs
       if data["generate_output_files"]:
          self.save_all_output_files(data["outputs"])
 
-      self.quit()
+      self._end_experiment()
+
+
+   @staticmethod
+   def run_pool(configs: List[Union[str, dict]], workers: int = None,
+                output_path: str = None) -> List[Tuple[str, Optional[Exception]]]:
+      """Run independent experiments in parallel worker processes.
+
+      Each config (file path or parsed config) becomes a job that runs in its own working
+      directory output_path/job_i with its own Amesim API session. Configs with a sweep are
+      split into at most `workers` jobs so the runs of one sweep also spread across cores.
+      A failed job doesn't stop the others. Returns the working directory of every job with
+      the exception it failed with, None if it succeeded.
+      """
+      if workers is None:
+         workers = os.cpu_count() or 1
+      if output_path is None:
+         output_path = os.path.join(os.getcwd(), "output", "pool")
+
+      jobs = []
+      job_configs = []
+      for i, config in enumerate(configs):
+         if isinstance(config, str):
+            data = SimulationService._parse_config_file(config)
+         else:
+            SimulationService._check_config(config)
+            data = dict(config)
+
+         # Workers run in their own directory, so the model and table paths must not be relative
+         data["model_file"] = os.path.abspath(data["model_file"])
+         time_series_data = {}
+         for table_name, table_spec in data.get("time_series_data", {}).items():
+            if "file" in table_spec:
+               table_spec = dict(table_spec, file=os.path.abspath(table_spec["file"]))
+            time_series_data[table_name] = table_spec
+         data["time_series_data"] = time_series_data
+         # Nobody can close interactive plot windows in a worker process
+         data["headless"] = True
+         # The jobs already use the cores, so each one renders its plots serially
+         data["plot_workers"] = 1
+
+         if "sweep" in data:
+            parameter_sets = SimulationService._expand_sweep(data["sweep"])
+            n_chunks = max(1, min(workers, len(parameter_sets)))
+            # Contiguous chunks, so the runs keep their number in the whole sweep (output/run_i)
+            bounds = [len(parameter_sets) * chunk // n_chunks for chunk in range(n_chunks + 1)]
+            for chunk in range(n_chunks):
+               first_run, end = bounds[chunk], bounds[chunk + 1]
+               jobs.append(dict(data, sweep={"sets": parameter_sets[first_run:end], "first_run": first_run}))
+               job_configs.append(config if isinstance(config, str) else f"config {i}")
+         else:
+            jobs.append(data)
+            job_configs.append(config if isinstance(config, str) else f"config {i}")
+
+      print(f"Running {len(jobs)} jobs on {workers} worker processes")
+
+      work_dirs = [os.path.join(output_path, f"job_{i}") for i in range(len(jobs))]
+      results = []
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+         futures = [executor.submit(_run_pool_job, job, work_dir) for job, work_dir in zip(jobs, work_dirs)]
+         for work_dir, job_config, future in zip(work_dirs, job_configs, futures):
+            try:
+               future.result()
+            except Exception as exc:
+               print(f"Job {work_dir} ({job_config}) failed: {exc!r}")
+               results.append((work_dir, exc))
+            else:
+               results.append((work_dir, None))
+
+      n_failed = sum(1 for _, error in results if error is not None)
+      print(f"{len(jobs) - n_failed} of {len(jobs)} jobs succeeded")
+      return results
+
+
+   def run_sweep(self, parameter_sets: List[dict], variable_names: List[str], output_path: str = None,
+                 first_run: int = 0) -> List[dict]:
+      """Run the loaded model once per parameter set and collect the outputs of each run.
+
+      The model is not reloaded between runs, so load_model must be called first. Each run
+      starts from the values the model was loaded with, plus the values of its parameter set.
+      If output_path is given, the files of run i are saved to output_path/run_i, numbered from
+      first_run for a part of a larger sweep.
+      """
+      print(f"Running parameter sweep with {len(parameter_sets)} runs")
+      self._save_sweep_file(parameter_sets, output_path)
+      base_values = self._sweep_base_values(parameter_sets)
+
+      results = []
+      for i, parameter_set in enumerate(parameter_sets):
+         print(f"Sweep run {i + 1}/{len(parameter_sets)}")
+         self.set_model_parameters(self._sweep_run_values(base_values, parameter_set))
 
+         self.run_simulation()
 
+         outputs = self.get_outputs(variable_names)
+
+         if output_path is not None:
+            self.save_all_output_files(variable_names, os.path.join(output_path, f"run_{first_run + i}"))
+
+         results.append({"parameters": parameter_set, "outputs": outputs})
+
+      return results
+
+
+   def _sweep_base_values(self, parameter_sets: List[dict]) -> Dict[str, str]:
+      """Value the loaded model has for every parameter swept by parameter_sets.
+
+      Each run starts from these values, so a run never inherits the values of the one
+      before it, whatever the order the runs are done in.
+      """
+      base_values = {}
+      for parameter_set in parameter_sets:
+         for param_name in parameter_set:
+            if param_name in base_values:
+               continue
+            if param_name in self._base_parameters:
+               base_values[param_name] = _parameter_text(self._base_parameters[param_name])
+            else:
+               # Neither the script nor the config sets it, read the value the model was built with
+               value = AMEGetParameterValue(param_name)[0]
+               base_values[param_name] = value
+               self._parameter_values.setdefault(param_name, value)
+               if self._model_defaults is not None:
+                  self._model_defaults[param_name] = value
+      return base_values
+
+
+   @staticmethod
+   def _sweep_run_values(base_values: Dict[str, str], parameter_set: dict) -> Dict[str, str]:
+      # Unchanged values are not sent again, so this only costs the parameters that differ
+      values = dict(base_values)
+      values.update({param_name: str(value) for param_name, value in parameter_set.items()})
+      return values
+
+
+   @staticmethod
+   def _save_sweep_file(parameter_sets: List[dict], output_path: str = None) -> None:
+      if output_path is not None:
+         os.makedirs(output_path, exist_ok=True)
+         with open(os.path.join(output_path, "sweep.json"), 'w') as file:
+            json.dump(parameter_sets, file, indent=2)
+
+
+   @traced("run")
+   def run_parallel(self, parameter_sets: List[dict], variable_names: List[str], circuits: int,
+                    output_path: str = None, first_run: int = 0) -> List[dict]:
+      """Run the loaded model once per parameter set on several circuits at the same time.
+
+      circuits - 1 copies of the loaded model are opened as extra circuits of the same API
+      session, so one license runs them all. Simulations are started without waiting for them,
+      and each one's outputs are collected as soon as it finishes, then its circuit starts
+      the next parameter set. Returns the same results, and saves the same files, as run_sweep.
+      """
+      n_circuits = max(1, min(circuits, len(parameter_sets)))
+      print(f"Running parameter sweep with {len(parameter_sets)} runs on {n_circuits} circuits")
+      self._save_sweep_file(parameter_sets, output_path)
+      if not parameter_sets:
+         return []
+
+      base_values = self._sweep_base_values(parameter_sets)
+
+      # Each circuit has its own parameter values
+      main_circuit = AMEGetActiveCircuit()
+      circuit_values = {main_circuit: self._parameter_values}
+      pending = list(enumerate(parameter_sets))
+      running = {}
+      results = [None] * len(parameter_sets)
+      try:
+         for _ in range(n_circuits - 1):
+            circuit, parameter_values = self._open_model_copy()
+            circuit_values[circuit] = parameter_values
+
+         for circuit in circuit_values:
+            if not pending:
+               break
+            self._start_run(circuit, circuit_values[circuit], base_values, pending.pop(0), len(parameter_sets), running)
+
+         poll_s = POLL_MIN_S
+         while running:
+            finished = [circuit for circuit in running if not AMEIsSimulationRunning(circuit)]
+            if not finished:
+               time.sleep(poll_s)
+               poll_s = min(poll_s * 2, POLL_MAX_S)
+               continue
+            poll_s = POLL_MIN_S
+
+            for circuit in finished:
+               i = running.pop(circuit)
+               self._activate_circuit(circuit, circuit_values[circuit])
+               try:
+                  # Raises if the simulation failed
+                  AMEWaitForSimulationEnd(circuit)
+               except:
+                  print(f"Error running simulation of sweep run {i + 1}")
+                  raise
+
+               outputs = self.get_outputs(variable_names)
+               if output_path is not None:
+                  self.save_all_output_files(variable_names, os.path.join(output_path, f"run_{first_run + i}"))
+               results[i] = {"parameters": parameter_sets[i], "outputs": outputs}
+
+               if pending:
+                  self._start_run(circuit, circuit_values[circuit], base_values, pending.pop(0), len(parameter_sets), running)
+      finally:
+         # Only left running when a run failed
+         for circuit in running:
+            AMEStopSimulation(circuit)
+         for circuit in circuit_values:
+            if circuit != main_circuit:
+               AMESetActiveCircuit(circuit)
+               self._close_circuit()
+         self._activate_circuit(main_circuit, circuit_values[main_circuit])
+
+      return results
+
+
+   def _start_run(self, circuit: str, parameter_values: Dict[str, str], base_values: Dict[str, str],
+                  run: Tuple[int, dict], n_runs: int, running: Dict[str, int]) -> None:
+      i, parameter_set = run
+      print(f"Sweep run {i + 1}/{n_runs} on {circuit}")
+      self._activate_circuit(circuit, parameter_values)
+      self.set_model_parameters(self._sweep_run_values(base_values, parameter_set))
+      try:
+         AMEStartSimulation(circuit)
+      except:
+         print("Error starting simulation")
+         raise
+      running[circuit] = i
+
+
+   def _activate_circuit(self, circuit: str, parameter_values: Dict[str, str]) -> None:
+      AMESetActiveCircuit(circuit)
+      # Parameter values and cached outputs are those of the active circuit
+      self._parameter_values = parameter_values
+      self._output_cache = {}
+
+
+   def _open_model_copy(self) -> Tuple[str, Dict[str, str]]:
+      """Build the loaded model again as a new circuit, with the same parameter and runtime values.
+      Returns the name of the circuit and its parameter values, the loaded circuit stays active."""
+      main_circuit = AMEGetActiveCircuit()
+      open_model, model_defaults, parameter_values = self._open_model, self._model_defaults, self._parameter_values
+      base_parameters = self._base_parameters
+
+      try:
+         self.load_model(open_model[0], dict(parameter_values), new_circuit=True)
+         if self._runtime_parameters is not None:
+            self.set_runtime_parameters(*self._runtime_parameters)
+         circuit = AMEGetActiveCircuit()
+         copy_values = self._parameter_values
+      finally:
+         self._open_model, self._model_defaults, self._base_parameters = open_model, model_defaults, base_parameters
+         self._activate_circuit(main_circuit, parameter_values)
+
+      return circuit, copy_values
+
+
+   @traced("set_parameters")
+   def set_batch(self, batch_type: str, parameters: dict) -> int:
+      """Set up an Amesim batch on the loaded model and return the number of runs.
+
+      batch_type is "SET" or "RANGE". For SET, parameters maps each parameter to a list of
+      values (one per run, all lists the same length). For RANGE, each parameter maps to an
+      object with "value", "step", "below" and "above", and every combination is run.
+      """
+      print(f"Setting {batch_type} batch for parameters: {', '.join(parameters)}")
+
+      # The batch API compares types by identity, so always use its own constants
+      if batch_type.upper() == "SET":
+         batch = AMECreateBatch(BATCH.SET)
+      elif batch_type.upper() == "RANGE":
+         batch = AMECreateBatch(BATCH.RANGE)
+      else:
+         raise ValueError(f"Error: Batch type must be SET or RANGE, got {batch_type}")
+
+      try:
+         for param_name, spec in parameters.items():
+            if batch.type is BATCH.SET:
+               param = AMEBatchCreateParam(param_name, {"set": [str(value) for value in spec]})
+            else:
+               param = AMEBatchCreateParam(param_name, {
+                  "value": spec["value"],
+                  "step": spec["step"],
+                  "below": int(spec["below"]),
+                  "above": int(spec["above"]),
+               })
+            AMEBatchPutParam(batch, param)
+
+         AMEPutBatch(batch)
+         AMESetSimulationType(SIMULATION_TYPE.BATCH)
+      except:
+         print("Error setting batch parameters")
+         raise
+
+      return AMEBatchGetNRuns(batch)
+
+
+   def run_batch(self, variable_names: List[str], output_path: str = None) -> dict:
+      """Run the batch set with set_batch and collect the outputs of each successful run.
+
+      Returns a dict keyed by run number. If output_path is given, the files of
+      run n are saved to output_path/batch_n.
+      """
+      try:
+         self.run_simulation()
+
+         runs = AMEGetBatchRuns()
+         print(f"Batch finished with {len(runs)} successful runs")
+
+         results = {}
+         for run in runs:
+            outputs = self.get_outputs(variable_names, run)
+
+            if output_path is not None:
+               self.save_all_output_files(variable_names, os.path.join(output_path, f"batch_{run}"), run)
+
+            results[run] = outputs
+      finally:
+         # Following runs on this model are single runs again, even if the batch failed,
+         # since in session mode the circuit stays open for the next experiment
+         AMESetSimulationType(SIMULATION_TYPE.SINGLE)
+
+      return results
+
+
+   @traced("run")
    def run_simulation(self) -> None:
       print("Running system simulation...")
+      self._output_cache = {}
       try:
          AMERunSimulation()
       except:
@@ -185,24 +912,82 @@ class SimulationService:
          raise
 
 
-   # Return an array of values for a single variable
-   def get_output_values(self, variable_name: str) -> Tuple[List[float], List[float]]:
+   # dataset selects the results of one batch run, None reads the last single run
+   @traced("fetch")
+   def _fetch_output(self, variable_name: str, dataset: str = None) -> Tuple[Sequence[float], Sequence[float]]:
+      """Time and variable values as arrays, or as tuples with API modules without AMEGetVariableArrays"""
+      # Results don't change until the next run, so each variable is only fetched once
+      cache_key = (variable_name, dataset)
+      if cache_key in self._output_cache:
+         return self._output_cache[cache_key]
+
       print(f"Getting output data for variable: {variable_name}")
       try:
-         pairs = AMEGetVariableValues(variable_name)
+         if AMEGetVariableArrays is not None:
+            values = AMEGetVariableArrays(variable_name, dataset)
+         else:
+            values = tuple(zip(*AMEGetVariableValues(variable_name, dataset)))
       except:
          print(f"Error retrieving output values for {variable_name}")
          raise
-      time_list, data_list = zip(*pairs)
-      return time_list, data_list
+      self._output_cache[cache_key] = values
+      return values
+
+
+   @traced("fetch")
+   def get_output_arrays(self, variable_name: str, dataset: str = None) -> Tuple[Sequence[float], Sequence[float]]:
+      """Return the time and variable values as float64 arrays (memoryviews without NumPy)"""
+      time_values, variable_values = self._fetch_output(variable_name, dataset)
+      if isinstance(time_values, tuple):
+         # Converted once, later calls get the arrays from the cache
+         arrays = (_as_float_array(time_values), _as_float_array(variable_values))
+         self._output_cache[(variable_name, dataset)] = arrays
+         return arrays
+      return time_values, variable_values
+
+
+   @traced("fetch")
+   def get_outputs(self, variable_names: List[str], dataset: str = None) -> Dict[str, Sequence[float]]:
+      """Return the outputs of the last run as columns: "time" followed by one array per variable.
+
+      All variables of a run share the time axis, so it is taken from the first variable only.
+      """
+      outputs = {}
+      for variable_name in variable_names:
+         time_values, variable_values = self.get_output_arrays(variable_name, dataset)
+         if "time" not in outputs:
+            outputs["time"] = time_values
+         elif len(variable_values) != len(outputs["time"]):
+            raise RuntimeError(f"Error: {variable_name} has {len(variable_values)} samples, expected {len(outputs['time'])}")
+         outputs[variable_name] = variable_values
+      return outputs
+
+
+   # Return an array of values for a single variable
+   def get_output_values(self, variable_name: str, dataset: str = None) -> Tuple[List[float], List[float]]:
+      time_values, variable_values = self._fetch_output(variable_name, dataset)
+      if isinstance(time_values, tuple):
+         return time_values, variable_values
+      return tuple(time_values.tolist()), tuple(variable_values.tolist())
 
 
    # Plot an output variable over time
+   @traced("plot")
    def plot_variable(self, variable_name: str) -> None:
+      if self.headless:
+         print(f"Headless mode, not displaying plot for variable: {variable_name}")
+         return
+
       # Get variable values
-      time_values, variable_values = self.get_output_values(variable_name)
+      outputs = self.get_outputs([variable_name])
 
       # Plot variables
+      plt = self._pyplot()
+      time_values, variable_values = outputs["time"], outputs[variable_name]
+      if self.decimate_plots:
+         figure = plt.gcf()
+         width_px = int(figure.get_figwidth() * figure.dpi)
+         time_values, variable_values = decimate_minmax(time_values, variable_values, width_px)
       plt.plot(time_values, variable_values, label=variable_name)
       plt.legend(loc="upper left")
       plt.xlabel("Time")
@@ -213,66 +998,60 @@ class SimulationService:
       plt.show()
 
 
-   def save_all_output_files(self, variable_names: List[str], output_path: str = None) -> None:
+   @traced("export")
+   def save_all_output_files(self, variable_names: List[str], output_path: str = None, dataset: str = None,
+                             output_format: str = None) -> None:
       print(f"Saving all output files...")
 
-      # Save CSV data
-      self.save_output_data_csv(variable_names, output_path)
+      # Save data
+      self.save_output_data(variable_names, output_path, dataset, output_format)
 
       # Save all plots
-      for variable_name in variable_names:
-         self.save_plot_pdf(variable_name, output_path)
+      self.save_plots_pdf(variable_names, output_path, dataset)
 
       return
    
 
-   def save_output_data_csv(self, variable_names: List[str], output_path: str = None) -> None:
+   @traced("export")
+   def save_output_data(self, variable_names: List[str], output_path: str = None, dataset: str = None,
+                        output_format: str = None) -> None:
+      """Save the output data as data.csv, data.npz, data.parquet or data.arrow"""
+      if output_format is None:
+         output_format = self.output_format
+      if output_format not in OUTPUT_FORMATS:
+         raise ValueError(f"Error: Output format must be one of {', '.join(OUTPUT_FORMATS)}, got {output_format}")
+
+      if output_format == "csv":
+         self.save_output_data_csv(variable_names, output_path, dataset)
+         return
 
       if output_path is None:
-         output_path = os.path.join(os.getcwd(), "output", "data.csv")
-      else:
-         output_path = os.path.join(output_path, "data.csv")
+         output_path = os.path.join(os.getcwd(), "output")
+      write_output_data(self.get_outputs(variable_names, dataset), output_path, output_format)
 
-      # Create the output directory if it doesn't exist
-      output_dir = os.path.dirname(output_path)
-      if not os.path.exists(output_dir):
-         os.makedirs(output_dir)
-      
-      print(f"Saving output data to {output_path}")
-
-      output_data = {}
-      for i, variable_name in enumerate(variable_names):
-         variable_output = self.get_output_values(variable_name)
-         output_data[variable_name] = variable_output[1]
-         if i == 0:
-            output_data["time"] = variable_output[0]
-      
-      # Save to CSV file with header
-      with open(output_path, 'w', newline='') as csvfile:
-         fieldnames = ["time"] + variable_names
-         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
-         writer.writeheader()
-         for i in range(len(output_data["time"])):
-               row = {field: output_data[field][i] for field in fieldnames}
-               writer.writerow(row)
+   @traced("export")
+   def save_output_data_csv(self, variable_names: List[str], output_path: str = None, dataset: str = None,
+                            float_format: str = None) -> None:
+
+      if output_path is None:
+         output_path = os.path.join(os.getcwd(), "output")
+
+      output_data = self.get_outputs(variable_names, dataset)
+
+      # Save to CSV file with header
+      write_output_data(output_data, output_path, "csv", float_format or self.csv_float_format)
 
       return
    
    
-   def save_plot_pdf(self, variable_name: str, output_path: str = None) -> None:
+   @traced("plot")
+   def save_plot_pdf(self, variable_name: str, output_path: str = None, dataset: str = None) -> None:
       
       print(f"Saving plot for variable: {variable_name} at {output_path}")
 
       # Get variable values
-      time_values, variable_values = self.get_output_values(variable_name)
-
-      # Plot variables
-      plt.plot(time_values, variable_values, label=variable_name)
-      plt.legend(loc="upper left")
-      plt.xlabel("Time")
-      plt.ylabel(variable_name)
-      plt.grid(True)
+      outputs = self.get_outputs([variable_name], dataset)
 
       if output_path is None:
          output_path = os.path.join(os.getcwd(), "output", f"{variable_name}.pdf")
@@ -284,12 +1063,117 @@ class SimulationService:
       if not os.path.exists(output_dir):
          os.makedirs(output_dir)
       
-      plt.savefig(output_path)
+      render_plot_pdf(outputs["time"], outputs[variable_name], variable_name, output_path, self.decimate_plots)
       return
+
+
+   @traced("plot")
+   def save_plots_pdf(self, variable_names: List[str], output_path: str = None, dataset: str = None,
+                      single_pdf: bool = None) -> None:
+      """Save {variable_name}.pdf for every variable, rendered in parallel with plot_workers processes,
+      or all variables as pages of plots.pdf with single_pdf"""
+
+      if output_path is None:
+         output_path = os.path.join(os.getcwd(), "output")
+      if single_pdf is None:
+         single_pdf = self.single_pdf
+
+      print(f"Saving plots for {len(variable_names)} variables at {output_path}")
+
+      outputs = self.get_outputs(variable_names, dataset)
+      executor = None if single_pdf else self._plot_pool(len(variable_names))
+      write_output_plots(outputs, variable_names, output_path, self.decimate_plots, single_pdf, executor)
+      return
+
+
+   def _plot_pool(self, n_plots: int) -> Optional[ProcessPoolExecutor]:
+      """Worker processes for rendering n_plots plots, None to render them in this process.
+      The pool has no more workers than plots, it is started again larger when more are needed."""
+      max_workers = self.plot_workers or os.cpu_count() or 1
+      if max_workers <= 1 or n_plots < PARALLEL_PLOTS_MIN:
+         return None
+
+      workers = min(max_workers, n_plots)
+      if self._plot_executor is not None and (workers > self._plot_executor_workers
+                                              or self._plot_executor_workers > max_workers):
+         self._shutdown_plot_pool()
+      if self._plot_executor is None:
+         self._plot_executor = ProcessPoolExecutor(max_workers=workers)
+         self._plot_executor_workers = workers
+      return self._plot_executor
+
+
+   def _shutdown_plot_pool(self) -> None:
+      if self._plot_executor is not None:
+         self._plot_executor.shutdown()
+         self._plot_executor = None
+         self._plot_executor_workers = 0
    
 
+   def _end_experiment(self) -> None:
+      self.save_trace()
+
+      # In session mode the circuit stays open for the next experiment
+      if self.session:
+         return
+      self.quit()
+
+
+   def save_trace(self) -> None:
+      """Save the stage and afp call timings so far to trace_report and chrome_trace, if set"""
+      if self.trace_report:
+         self.tracer.write_report(self.trace_report)
+      if self.chrome_trace:
+         self.tracer.write_chrome_trace(self.chrome_trace)
+
+
+   def _close_circuit(self) -> None:
+      AMECloseCircuit(True)
+      # A new circuit may get the same name
+      if AMEInvalidateModeCache is not None:
+         AMEInvalidateModeCache()
+
+
    def quit(self):
       print(f"Quitting Simulation Service...")
-      self._delete_temporary_files()
-      AMECloseCircuit(True)
+      self._output_cache = {}
+      self._open_model = None
+      self._model_defaults = None
+      self._base_parameters = {}
+      self._parameter_values = {}
+      self._close_circuit()
       AMECloseAPI(False)
+      self.tracer.uninstall()
+      self._shutdown_plot_pool()
+
+
+# Service of a pool worker process, kept open across the jobs the worker runs, and its quit
+_pool_service = None
+_pool_service_quit = None
+
+
+def _run_pool_job(data: dict, work_dir: str) -> str:
+   global _pool_service, _pool_service_quit
+
+   # Each job gets its own directory so output files don't collide
+   os.makedirs(work_dir, exist_ok=True)
+   os.chdir(work_dir)
+
+   if _pool_service is None:
+      _pool_service = SimulationService(headless=True, session=True)
+      # Return the license when the worker process exits
+      _pool_service_quit = multiprocessing.util.Finalize(_pool_service, _pool_service.quit, exitpriority=10)
+   try:
+      # Jobs are independent, a job doesn't keep the settings of the one before it
+      _pool_service.run_from_config(data, reset_settings=True)
+   except:
+      # The failed job may have left a circuit half built, the next job starts a new session
+      print("Error running pool job, closing its session")
+      service_quit, _pool_service, _pool_service_quit = _pool_service_quit, None, None
+      try:
+         service_quit()
+      except Exception as exc:
+         print(f"Error closing session: {exc!r}")
+      raise
+
+   return work_dir
@@ -0,0 +1,189 @@
+import csv
+import hashlib
+import io
+import getpass
+import os
+import stat
+import tempfile
+import time
+from typing import Optional, Sequence
+
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+##############################################################################################
+
+# Version of the table file layout, part of every key so a format change never reuses old files
+TABLE_FORMAT = "txt-space-v1"
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Files used this recently are never evicted, another run may be about to read them
+EVICTION_GRACE_S = 300
+
+
+def _fast_temp_dir() -> str:
+   """Directory for temporary files, in memory (tmpfs) when the system has one big enough for the store.
+   Containers often have a /dev/shm of only 64 MB, which a full store would fill."""
+   if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+      fs = os.statvfs("/dev/shm")
+      if fs.f_blocks * fs.f_frsize >= 4 * DEFAULT_MAX_BYTES:
+         return "/dev/shm"
+   return tempfile.gettempdir()
+
+
+def _user_id() -> str:
+   return str(os.getuid()) if hasattr(os, "getuid") else getpass.getuser()
+
+
+def _private_dir(path: str) -> None:
+   """Create path for the current user only, or check that the existing one is"""
+   try:
+      os.mkdir(path, 0o700)
+   except FileExistsError:
+      pass
+
+   # Not following links: a link planted by another user could point anywhere
+   info = os.lstat(path)
+   if not stat.S_ISDIR(info.st_mode):
+      raise RuntimeError(f"Error: Table store {path} is not a directory")
+   if hasattr(os, "getuid"):
+      # Anyone else able to write there could plant tables under the keys we use
+      if info.st_uid != os.getuid():
+         raise RuntimeError(f"Error: Table store {path} is owned by another user")
+      if info.st_mode & 0o077:
+         raise RuntimeError(f"Error: Table store {path} must only be accessible by its owner (mode 0700)")
+
+
+def _format_table(time_col: Sequence, data_col: Sequence) -> str:
+   if np is not None and isinstance(time_col, np.ndarray):
+      # Format all rows with a single % operation
+      values = np.column_stack((time_col, data_col)).ravel().tolist()
+      return ("%r %r\r\n" * len(time_col)) % tuple(values)
+
+   table = io.StringIO(newline='')
+   csv_writer = csv.writer(table, delimiter=' ')
+   csv_writer.writerows(zip(time_col, data_col))
+   return table.getvalue()
+
+
+class TableStore:
+   """Content-addressed store of time-series table files shared by runs and worker processes.
+
+   A table is keyed by a hash of its time column, data column and the file format, so the
+   same profile is only written once. Files are published atomically with a rename, and the
+   least recently used files are removed once the store grows past max_bytes.
+
+   The default root is private to the current user, so it is shared by their runs only.
+   """
+
+   def __init__(self, root: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+      if root is None:
+         root = os.path.join(_fast_temp_dir(), f"simulation_service_tables_{_user_id()}")
+      _private_dir(root)
+      self.root = root
+      self.max_bytes = max_bytes
+
+
+   @staticmethod
+   def key(time_col: Sequence, data_col: Sequence) -> str:
+      digest = hashlib.sha256(TABLE_FORMAT.encode())
+      for column in (time_col, data_col):
+         if np is not None and isinstance(column, np.ndarray):
+            digest.update(b"ndarray:")
+            digest.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+         else:
+            digest.update("\x1f".join(map(str, column)).encode())
+         digest.update(b"\x1e")
+      return digest.hexdigest()
+
+
+   def _path(self, key: str) -> str:
+      return os.path.join(self.root, f"{key}.txt")
+
+
+   def get(self, key: str) -> Optional[str]:
+      """Path of the stored table, or None if it is not in the store"""
+      path = self._path(key)
+      try:
+         # The modification time records the last use for eviction
+         os.utime(path)
+      except FileNotFoundError:
+         return None
+      return path
+
+
+   def put(self, key: str, content: str) -> str:
+      """Publish a table file under key and return its path"""
+      path = self._path(key)
+
+      # Readers only ever see complete files: write to a temporary name, then rename
+      fd, temp_path = tempfile.mkstemp(dir=self.root, prefix=f".{key}.", suffix=".tmp")
+      try:
+         with os.fdopen(fd, 'w', newline='') as temp_file:
+            temp_file.write(content)
+         os.replace(temp_path, path)
+      except OSError:
+         os.remove(temp_path)
+         # On Windows the rename fails while another worker has the same table open,
+         # its content is identical so that file can be used as is
+         if not os.path.exists(path):
+            raise
+
+      self._evict(keep=path)
+      return path
+
+
+   def resolve(self, time_col: Sequence, data_col: Sequence) -> str:
+      """Path of a file holding the table, written only if the store doesn't have it yet"""
+      key = self.key(time_col, data_col)
+      path = self.get(key)
+      if path is None:
+         path = self.put(key, _format_table(time_col, data_col))
+      return path
+
+
+   def _evict(self, keep: str) -> None:
+      entries = []
+      total_bytes = 0
+      for entry in os.scandir(self.root):
+         if not entry.name.endswith(".txt"):
+            continue
+         try:
+            stat = entry.stat()
+         except FileNotFoundError:
+            continue
+         entries.append((stat.st_mtime, stat.st_size, entry.path))
+         total_bytes += stat.st_size
+
+      if total_bytes <= self.max_bytes:
+         return
+
+      recent = time.time() - EVICTION_GRACE_S
+      for mtime, size, path in sorted(entries):
+         if total_bytes <= self.max_bytes or mtime > recent:
+            break
+         if path == keep:
+            continue
+         if self._remove_unused(path, recent):
+            total_bytes -= size
+
+
+   def _remove_unused(self, path: str, recent: float) -> bool:
+      """Remove a table file unless get() used it since the directory was scanned"""
+      # Once renamed, get() no longer finds the file and writes it again instead of using it
+      evicted_path = f"{path}.{os.getpid()}.evicted"
+      try:
+         os.rename(path, evicted_path)
+      except OSError:
+         # Another worker evicted it first, or on Windows someone has it open
+         return False
+
+      # A get() just before the rename marked the file as used, and its caller will read it
+      if os.stat(evicted_path).st_mtime > recent:
+         os.replace(evicted_path, path)
+         return False
+      os.remove(evicted_path)
+      return True
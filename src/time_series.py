@@ -0,0 +1,102 @@
+import os
+from typing import Sequence, Tuple
+
+try:
+   import numpy as np
+except ImportError:
+   np = None
+
+##############################################################################################
+
+# A table in the config's time_series_data can be given as:
+#   {"1": 0, "2": 0.1, ...}                           time keys to values (original format)
+#   {"time": [1, 2, ...], "value": [0, 0.1, ...]}     inline column arrays
+#   {"file": "profile.npy"}                           (N, 2) array of time and value
+#   {"file": "profile.csv", "skip_header": 1}         first two columns, "," or whitespace delimited
+#   {"file": "profile.parquet", "time": "t", "value": "throttle"}   named (default first two) columns
+
+
+def is_columnar_spec(spec: dict) -> bool:
+   """Whether a table spec uses one of the columnar forms rather than time keys to values"""
+   return "file" in spec or ("time" in spec and "value" in spec)
+
+
+def _require_numpy() -> None:
+   if np is None:
+      raise ImportError("Error: NumPy is required for time-series files and inline arrays")
+
+
+def _read_csv(path: str, spec: dict):
+   delimiter = spec.get("delimiter")
+   skip_header = spec.get("skip_header", 0)
+   if delimiter is None:
+      # Tables written by Amesim tools are whitespace delimited even when named .csv
+      with open(path, 'r') as file:
+         for _ in range(skip_header):
+            file.readline()
+         first_line = file.readline()
+      delimiter = "," if "," in first_line else None
+   data = np.loadtxt(path, delimiter=delimiter, skiprows=skip_header, usecols=(0, 1), ndmin=2, dtype=np.float64)
+   return data[:, 0], data[:, 1]
+
+
+def _read_npy(path: str, spec: dict):
+   data = np.load(path)
+   if data.ndim != 2 or data.shape[1] < 2:
+      raise ValueError(f"Error: {path} must hold an (N, 2) array of time and value")
+   return data[:, 0], data[:, 1]
+
+
+def _read_parquet(path: str, spec: dict):
+   try:
+      import pyarrow.parquet as pq
+   except ImportError:
+      raise ImportError("Error: pyarrow is required for Parquet time-series files")
+   table = pq.read_table(path)
+   time_name = spec.get("time", table.column_names[0])
+   value_name = spec.get("value", table.column_names[1])
+   return table.column(time_name).to_numpy(), table.column(value_name).to_numpy()
+
+
+_READERS = {
+   ".csv": _read_csv,
+   ".txt": _read_csv,
+   ".data": _read_csv,
+   ".npy": _read_npy,
+   ".parquet": _read_parquet,
+}
+
+
+def _validate(table_name: str, time_col, data_col):
+   """Convert both columns to float64 and check them in one vectorized pass"""
+   time_col = np.ascontiguousarray(time_col, dtype=np.float64)
+   data_col = np.ascontiguousarray(data_col, dtype=np.float64)
+
+   if time_col.ndim != 1 or time_col.shape != data_col.shape:
+      raise ValueError(f"Error: {table_name} time and value columns must be 1-D and the same length")
+   if len(time_col) == 0:
+      raise ValueError(f"Error: {table_name} is empty")
+   if not (np.isfinite(time_col).all() and np.isfinite(data_col).all()):
+      raise ValueError(f"Error: {table_name} contains NaN or infinite values")
+   if (np.diff(time_col) < 0).any():
+      raise ValueError(f"Error: {table_name} time column must be increasing")
+
+   return time_col, data_col
+
+
+def load_time_series(table_name: str, spec: dict) -> Tuple[Sequence, Sequence]:
+   """Return the time and value columns of a time_series_data table"""
+   if not is_columnar_spec(spec):
+      return spec.keys(), spec.values()
+
+   _require_numpy()
+   if "file" in spec:
+      path = spec["file"]
+      extension = os.path.splitext(path)[1].lower()
+      if extension not in _READERS:
+         raise ValueError(f"{extension}: Time-series file must have correct file extension: {', '.join(_READERS)}")
+      time_col, data_col = _READERS[extension](path, spec)
+   else:
+      time_col, data_col = spec["time"], spec["value"]
+
+   return _validate(table_name, time_col, data_col)
@@ -0,0 +1,199 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List
+
+##############################################################################################
+
+# Stage of the calls made outside of any traced stage
+NO_STAGE = "other"
+
+
+def command_name(target: str) -> str:
+   """Command of an afp target, e.g. "prop=mode" for "circuit(1):prop=mode".
+
+   Targets are ':' separated paths to the circuit or data item, ending with the property
+   or command and its '|' separated arguments. Plain command names are returned as is.
+   """
+   for part in reversed(target.split(':')):
+      if part.startswith(("prop=", "cmd=")):
+         return part.split('|')[0]
+   return target
+
+
+def _payload_size(value) -> int:
+   return len(value) if isinstance(value, (str, bytes)) else 0
+
+
+class Tracer:
+   """Times the stages of a SimulationService run and the afp calls made in each stage.
+
+   Stages are entered with stage(), or the traced decorator on SimulationService methods.
+   A stage entered inside another one is timed on its own and left out of the self time of
+   the outer stage. Once install() wraps afp.get and afp.set, every call is recorded with
+   its command, latency and payload size, under the innermost stage of its thread.
+   """
+
+   def __init__(self, keep_events: bool = False):
+      # Individual events are only needed for the Chrome trace
+      self.keep_events = keep_events
+      self.events = []
+      self.stages = {}
+      self.calls = {}
+      self._local = threading.local()
+      self._lock = threading.Lock()
+      self._afp = None
+      self._originals = None
+      self._start = time.perf_counter()
+
+
+   def _stack(self) -> List[list]:
+      stack = getattr(self._local, "stack", None)
+      if stack is None:
+         stack = self._local.stack = []
+      return stack
+
+
+   def current_stage(self) -> str:
+      stack = self._stack()
+      return stack[-1][0] if stack else NO_STAGE
+
+
+   @contextmanager
+   def stage(self, name: str):
+      stack = self._stack()
+      # Methods of a stage calling each other, e.g. save_all_output_files, are one stage
+      if stack and stack[-1][0] == name:
+         yield
+         return
+
+      # [name, time spent in inner stages]
+      frame = [name, 0.0]
+      stack.append(frame)
+      start = time.perf_counter()
+      try:
+         yield
+      finally:
+         duration = time.perf_counter() - start
+         stack.pop()
+         if stack:
+            stack[-1][1] += duration
+         with self._lock:
+            stats = self.stages.setdefault(name, {"count": 0, "total_s": 0.0, "self_s": 0.0,
+                                                  "afp_calls": 0, "afp_s": 0.0})
+            stats["count"] += 1
+            stats["total_s"] += duration
+            stats["self_s"] += duration - frame[1]
+            if self.keep_events:
+               self.events.append(("stage", name, start, duration, threading.get_ident(), {}))
+
+
+   def _record_call(self, method: str, target: str, start: float, duration: float,
+                    bytes_sent: int, bytes_received: int) -> None:
+      command = command_name(target)
+      stage = self.current_stage()
+      with self._lock:
+         stats = self.calls.setdefault(f"{method} {command}", {"count": 0, "total_s": 0.0, "max_s": 0.0,
+                                                               "bytes_sent": 0, "bytes_received": 0})
+         stats["count"] += 1
+         stats["total_s"] += duration
+         stats["max_s"] = max(stats["max_s"], duration)
+         stats["bytes_sent"] += bytes_sent
+         stats["bytes_received"] += bytes_received
+
+         stage_stats = self.stages.setdefault(stage, {"count": 0, "total_s": 0.0, "self_s": 0.0,
+                                                      "afp_calls": 0, "afp_s": 0.0})
+         stage_stats["afp_calls"] += 1
+         stage_stats["afp_s"] += duration
+
+         if self.keep_events:
+            args = {"target": target, "stage": stage, "bytes_sent": bytes_sent, "bytes_received": bytes_received}
+            self.events.append(("afp", f"{method} {command}", start, duration, threading.get_ident(), args))
+
+
+   def _wrap(self, method: str, function: Callable) -> Callable:
+      @functools.wraps(function)
+      def traced_call(target, *args):
+         start = time.perf_counter()
+         result = None
+         try:
+            result = function(target, *args)
+            return result
+         finally:
+            duration = time.perf_counter() - start
+            bytes_sent = sum(_payload_size(arg) for arg in args)
+            self._record_call(method, target, start, duration, bytes_sent, _payload_size(result))
+      return traced_call
+
+
+   def install(self, afp) -> None:
+      """Record every afp.get and afp.set call, until uninstall"""
+      if self._afp is not None:
+         return
+      self._afp = afp
+      self._originals = (afp.get, afp.set)
+      afp.get = self._wrap("get", afp.get)
+      afp.set = self._wrap("set", afp.set)
+
+
+   def uninstall(self) -> None:
+      if self._afp is None:
+         return
+      self._afp.get, self._afp.set = self._originals
+      self._afp = None
+      self._originals = None
+
+
+   def report(self) -> dict:
+      """Stage timings and afp call statistics, slowest first"""
+      with self._lock:
+         stages = {name: dict(stats) for name, stats in self.stages.items()}
+         calls = {name: dict(stats) for name, stats in self.calls.items()}
+      for stats in calls.values():
+         stats["mean_s"] = stats["total_s"] / stats["count"]
+      return {
+         "elapsed_s": time.perf_counter() - self._start,
+         "afp_calls": sum(stats["count"] for stats in calls.values()),
+         "afp_s": sum(stats["total_s"] for stats in calls.values()),
+         "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["self_s"])),
+         "calls": dict(sorted(calls.items(), key=lambda item: -item[1]["total_s"])),
+      }
+
+
+   def write_report(self, output_path: str) -> None:
+      print(f"Saving trace report to: {output_path}")
+      with open(output_path, 'w') as file:
+         json.dump(self.report(), file, indent=2)
+
+
+   def write_chrome_trace(self, output_path: str) -> None:
+      """Save the recorded events for chrome://tracing or Perfetto, requires keep_events"""
+      print(f"Saving Chrome trace to: {output_path}")
+      pid = os.getpid()
+      with self._lock:
+         events = list(self.events)
+      trace_events = [
+         {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+          "ts": (start - self._start) * 1e6, "dur": duration * 1e6, "args": args}
+         for category, name, start, duration, tid, args in events
+      ]
+      with open(output_path, 'w') as file:
+         json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+
+def traced(stage_name: str) -> Callable:
+   """Decorator timing a method of an object with a tracer attribute as stage_name"""
+   def decorator(method: Callable) -> Callable:
+      @functools.wraps(method)
+      def wrapper(self, *args, **kwargs):
+         tracer = getattr(self, "tracer", None)
+         if tracer is None:
+            return method(self, *args, **kwargs)
+         with tracer.stage(stage_name):
+            return method(self, *args, **kwargs)
+      return wrapper
+   return decorator
+
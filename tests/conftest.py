@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+   sys.path.insert(0, SRC_DIR)
+
+# The service imports ame_apy when it is first imported, so the fake API goes in first
+import benchmark
+benchmark._install_fake_api()
+
+import fake_afp
+
+##############################################################################################
+
+
+@pytest.fixture
+def fake_api():
+   """Fake afp with no open circuits, no latency and instant simulations"""
+   fake_afp.reset()
+   fake_afp.configure(latency=0.0, command_latency={}, simulation=0.0)
+   yield fake_afp
+   fake_afp.reset()
+
+
+@pytest.fixture
+def model_file(tmp_path):
+   """Model script of 3 connected components and 6 parameters, see benchmark.generate_model"""
+   path = str(tmp_path / "model.py")
+   benchmark.generate_model(path, 300, 6)
+   return path
+
+
+@pytest.fixture
+def service(fake_api, tmp_path, monkeypatch):
+   from simulation_service import SimulationService
+
+   # Anything saved without an output path goes to ./output
+   monkeypatch.chdir(tmp_path)
+   service = SimulationService(headless=True, session=True)
+   yield service
+   service._shutdown_plot_pool()
+   service.tracer.uninstall()
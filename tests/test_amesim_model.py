@@ -0,0 +1,93 @@
+import marshal
+
+import pytest
+
+from amesim_model import PARAMETERS_MARKER, AmesimModel
+
+##############################################################################################
+
+MODEL_CODE = """\
+AMECreateCircuit('plane', 'extra')
+AMEAddComponent('mass2port', 'mass_0', (0, 100))
+AMEChangeSubmodel('mass_0', 'MAS002', r'$AME\\libmec\\submodels')
+AMEAddComponent('mass2port', 'mass_1', (50, 100))
+AMESetParameterValue('p0@mass_0', '1.0')
+AMESetParameterValue('p1@mass_1', '2.0')
+AMESetParameterValue('p0@mass_0', '3.0')
+AMEConnectTwoPorts('mass_0', 1, 'mass_1', 0)
+"""
+
+
+class _RecordingApi(dict):
+   """API functions that only record their calls"""
+
+   def __init__(self):
+      super().__init__()
+      self.calls = []
+
+   def __missing__(self, function):
+      return lambda *args, **kwargs: self.calls.append((function, args, kwargs))
+
+
+def test_parse_keeps_parameters_apart():
+   model = AmesimModel.parse(MODEL_CODE)
+
+   assert model.circuit_name == "plane"
+   # Repeated data paths keep their first position and last value
+   assert model.parameters == {"p0@mass_0": "3.0", "p1@mass_1": "2.0"}
+   assert [call.function for call in model.calls] == [
+      "AMEAddComponent", "AMEChangeSubmodel", "AMEAddComponent", PARAMETERS_MARKER, "AMEConnectTwoPorts",
+   ]
+   assert len(model.components) == 2
+   assert len(model.submodels) == 1
+   assert len(model.connections) == 1
+
+
+def test_replay_follows_script_with_overrides():
+   model = AmesimModel.parse(MODEL_CODE)
+   api = _RecordingApi()
+   values = model.replay(api, {"p1@mass_1": "5.0", "p2@mass_1": "6.0"})
+
+   assert values == {"p0@mass_0": "3.0", "p1@mass_1": "5.0", "p2@mass_1": "6.0"}
+   assert api.calls == [
+      ("AMECreateCircuit", ("plane", "extra"), {}),
+      ("AMEAddComponent", ("mass2port", "mass_0", (0, 100)), {}),
+      ("AMEChangeSubmodel", ("mass_0", "MAS002", r"$AME\libmec\submodels"), {}),
+      ("AMEAddComponent", ("mass2port", "mass_1", (50, 100)), {}),
+      ("AMESetParameterValue", ("p0@mass_0", "3.0"), {}),
+      ("AMESetParameterValue", ("p1@mass_1", "5.0"), {}),
+      ("AMESetParameterValue", ("p2@mass_1", "6.0"), {}),
+      ("AMEConnectTwoPorts", ("mass_0", 1, "mass_1", 0), {}),
+   ]
+   # The parsed model is unchanged
+   assert model.parameters == {"p0@mass_0": "3.0", "p1@mass_1": "2.0"}
+
+
+def test_parse_rejects_calls_after_parameters():
+   code = MODEL_CODE + "AMEChangeSubmodel('mass_1', 'MAS002', 'lib')\n"
+   with pytest.raises(ValueError):
+      AmesimModel.parse(code)
+
+
+@pytest.mark.parametrize("code", [
+   "AMEAddComponent('mass2port', 'mass_0', (0, 100))\n",
+   "AMECreateCircuit('plane')\nx = 1\n",
+   "AMECreateCircuit('plane')\nAMESetParameterValue('p@m', str(1))\n",
+])
+def test_parse_rejects_other_code(code):
+   with pytest.raises(ValueError):
+      AmesimModel.parse(code)
+
+
+def test_serialized_model_round_trip():
+   model = AmesimModel.parse(MODEL_CODE)
+   loaded = AmesimModel.loads(model.dumps())
+
+   assert loaded.create_call == model.create_call
+   assert loaded.calls == model.calls
+   assert loaded.parameters == model.parameters
+
+
+def test_loads_rejects_other_format():
+   with pytest.raises(ValueError):
+      AmesimModel.loads(marshal.dumps(("plane", (), {})))
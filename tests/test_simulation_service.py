@@ -0,0 +1,138 @@
+import pytest
+
+import simulation_service
+from simulation_service import AMEGetParameterValue, AMEIsSimulationRunning
+
+##############################################################################################
+
+VARIABLES = ["x@mass_0", "v@mass_1"]
+
+
+def _values_sent(fake_api) -> int:
+   return fake_api.call_counts().get("set data_value", 0)
+
+
+def _model_value(param_name: str) -> str:
+   return AMEGetParameterValue(param_name)[0]
+
+
+@pytest.mark.parametrize("structured_model", [False, True])
+def test_load_model_sets_script_and_config_values(service, fake_api, model_file, structured_model):
+   service.structured_model = structured_model
+   service.load_model(model_file, {"p1@mass_1": "7", "q@mass_0": "8"})
+
+   assert _model_value("p0@mass_0") == "0.0"
+   assert _model_value("p1@mass_1") == "7"
+   assert _model_value("q@mass_0") == "8"
+   if structured_model:
+      # The script's 6 values, with the override in place of the script's, and the new one
+      assert _values_sent(fake_api) == 7
+
+
+def test_unchanged_parameters_are_not_sent(service, fake_api, model_file):
+   service.load_model(model_file)
+   sent = _values_sent(fake_api)
+
+   service.set_model_parameters({"p0@mass_0": "0.0", "p1@mass_1": "1.0"})
+   service.set_model_parameter("p2@mass_2", "2.0")
+   assert _values_sent(fake_api) == sent
+
+   service.set_model_parameters({"p0@mass_0": "0.0", "p1@mass_1": "5"})
+   assert _values_sent(fake_api) == sent + 1
+   assert _model_value("p1@mass_1") == "5"
+
+   service.set_model_parameters({"p0@mass_0": "0.0", "p1@mass_1": "5"}, force=True)
+   assert _values_sent(fake_api) == sent + 3
+
+
+def test_failed_set_sends_values_again(service, fake_api, model_file, monkeypatch):
+   service.load_model(model_file)
+
+   def fail(*args):
+      raise RuntimeError("Error: set failed")
+
+   monkeypatch.setattr(simulation_service, "AMESetParameterValue", fail)
+   with pytest.raises(RuntimeError):
+      service.set_model_parameter("p0@mass_0", "4")
+   monkeypatch.undo()
+
+   # The value in Amesim is unknown after the failure, so even the old value is sent
+   sent = _values_sent(fake_api)
+   service.set_model_parameter("p0@mass_0", "0.0")
+   assert _values_sent(fake_api) == sent + 1
+
+
+def test_invalid_path_sends_nothing(service, fake_api, model_file, monkeypatch):
+   service.load_model(model_file)
+   # Modules without the batch call fall back to one call per value
+   monkeypatch.setattr(simulation_service, "AMESetParameterValues", None)
+
+   sent = _values_sent(fake_api)
+   with pytest.raises(ValueError):
+      service.set_model_parameters({"p0@mass_0": "4", "@mass_0": "1"})
+   assert _values_sent(fake_api) == sent
+   assert _model_value("p0@mass_0") == "0.0"
+
+
+@pytest.mark.parametrize("structured_model", [False, True])
+def test_session_only_sends_changes(service, fake_api, model_file, structured_model):
+   service.structured_model = structured_model
+   service.load_model(model_file, {"p1@mass_1": "7", "q@mass_0": "8"})
+   sent = _values_sent(fake_api)
+
+   # Same model: p1 goes back to the script's value and q to the model's, p2 changes
+   service.load_model(model_file, {"p2@mass_2": "9"})
+   assert _values_sent(fake_api) == sent + 3
+   assert _model_value("p1@mass_1") == "1.0"
+   assert _model_value("q@mass_0") == "0"
+   assert _model_value("p2@mass_2") == "9"
+
+   service.load_model(model_file, {"p2@mass_2": "9"})
+   assert _values_sent(fake_api) == sent + 3
+
+
+def test_run_parallel_schedules_runs_on_circuits(service, fake_api, model_file, tmp_path, monkeypatch):
+   fake_api.configure(simulation=0.05)
+   service.load_model(model_file)
+   main_circuit = simulation_service.AMEGetActiveCircuit()
+
+   # Each start records its circuit, the values it runs with and how many others are running
+   starts = []
+   start_simulation = simulation_service.AMEStartSimulation
+
+   def record_start(circuit):
+      others = [started for started, _, _ in starts if started != circuit]
+      running = sum(1 for started in set(others) if AMEIsSimulationRunning(started))
+      starts.append((circuit, {"p0@mass_0": _model_value("p0@mass_0"), "p1@mass_1": _model_value("p1@mass_1")},
+                     running))
+      start_simulation(circuit)
+
+   monkeypatch.setattr(simulation_service, "AMEStartSimulation", record_start)
+
+   parameter_sets = [{"p0@mass_0": str(i)} for i in range(4)] + [{"p1@mass_1": "10"}]
+   results = service.run_parallel(parameter_sets, VARIABLES, 2, str(tmp_path / "sweep"), first_run=3)
+
+   # Two circuits, started without waiting for each other
+   assert len(starts) == 5
+   assert len({circuit for circuit, _, _ in starts}) == 2
+   assert starts[1][2] == 1
+   # Each run has its own values, the others at the model's
+   assert [values for _, values, _ in starts] == [
+      {"p0@mass_0": "0", "p1@mass_1": "1.0"},
+      {"p0@mass_0": "1", "p1@mass_1": "1.0"},
+      {"p0@mass_0": "2", "p1@mass_1": "1.0"},
+      {"p0@mass_0": "3", "p1@mass_1": "1.0"},
+      {"p0@mass_0": "0.0", "p1@mass_1": "10"},
+   ]
+
+   # Results in the order of the parameter sets, output directories numbered from first_run
+   assert [result["parameters"] for result in results] == parameter_sets
+   assert all(set(result["outputs"]) >= set(VARIABLES) for result in results)
+   assert sorted(path.name for path in (tmp_path / "sweep").iterdir() if path.is_dir()) == [
+      f"run_{i}" for i in range(3, 8)
+   ]
+
+   # Only the loaded circuit is left, active and with its own values
+   assert list(fake_api._circuits) == [main_circuit]
+   assert simulation_service.AMEGetActiveCircuit() == main_circuit
+   assert _model_value("p0@mass_0") == "0.0"
@@ -0,0 +1,109 @@
+import os
+import time
+
+import pytest
+
+import table_store
+from table_store import TableStore
+
+##############################################################################################
+
+
+def _age(path: str, seconds: float) -> None:
+   """Make path look last used seconds ago"""
+   used = time.time() - seconds
+   os.utime(path, (used, used))
+
+
+def test_put_publishes_complete_file(tmp_path):
+   store = TableStore(str(tmp_path / "tables"))
+   path = store.put("abc", "0 1\r\n1 2\r\n")
+
+   assert path == os.path.join(store.root, "abc.txt")
+   with open(path, newline='') as file:
+      assert file.read() == "0 1\r\n1 2\r\n"
+   # Nothing is left under its temporary name
+   assert os.listdir(store.root) == ["abc.txt"]
+
+
+def test_put_replaces_existing_file(tmp_path):
+   store = TableStore(str(tmp_path / "tables"))
+   store.put("abc", "old")
+   path = store.put("abc", "new")
+
+   with open(path) as file:
+      assert file.read() == "new"
+   assert os.listdir(store.root) == ["abc.txt"]
+
+
+def test_failed_put_removes_temporary_file(tmp_path, monkeypatch):
+   store = TableStore(str(tmp_path / "tables"))
+
+   def fail_replace(source, destination):
+      raise OSError("rename failed")
+
+   monkeypatch.setattr(table_store.os, "replace", fail_replace)
+   with pytest.raises(OSError):
+      store.put("abc", "0 1\r\n")
+   assert os.listdir(store.root) == []
+
+
+def test_resolve_writes_each_table_once(tmp_path, monkeypatch):
+   store = TableStore(str(tmp_path / "tables"))
+   first = store.resolve([0, 1], [5, 6])
+
+   def no_put(key, content):
+      raise AssertionError("table written again")
+
+   monkeypatch.setattr(store, "put", no_put)
+   assert store.resolve([0, 1], [5, 6]) == first
+   assert store.get(TableStore.key([0, 1], [5, 7])) is None
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+   store = TableStore(str(tmp_path / "tables"), max_bytes=250)
+   paths = [store.put(f"t{i}", "x" * 100) for i in range(2)]
+   for i, path in enumerate(paths):
+      _age(path, table_store.EVICTION_GRACE_S + 100 - i)
+
+   # 300 bytes with the new table, the oldest one goes
+   new_path = store.put("t2", "x" * 100)
+   assert not os.path.exists(paths[0])
+   assert os.path.exists(paths[1])
+   assert os.path.exists(new_path)
+
+
+def test_eviction_keeps_recently_used(tmp_path):
+   store = TableStore(str(tmp_path / "tables"), max_bytes=150)
+   old_path = store.put("old", "x" * 100)
+   _age(old_path, table_store.EVICTION_GRACE_S + 100)
+   recent_path = store.put("recent", "x" * 100)
+
+   # Another run may be about to read it, so the store stays over max_bytes
+   assert not os.path.exists(old_path)
+   store.put("new", "x" * 100)
+   assert os.path.exists(recent_path)
+
+
+def test_eviction_skips_table_used_after_scan(tmp_path):
+   store = TableStore(str(tmp_path / "tables"))
+   path = store.put("abc", "0 1\r\n")
+   recent = time.time() - table_store.EVICTION_GRACE_S
+
+   # get() marked it as used between the scan and the removal
+   assert not store._remove_unused(path, recent)
+   assert os.listdir(store.root) == ["abc.txt"]
+
+   _age(path, table_store.EVICTION_GRACE_S + 100)
+   assert store._remove_unused(path, recent)
+   assert os.listdir(store.root) == []
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX permissions only")
+def test_store_must_be_private(tmp_path):
+   root = tmp_path / "tables"
+   root.mkdir(mode=0o755)
+   os.chmod(root, 0o755)
+
+   with pytest.raises(RuntimeError):
+      TableStore(str(root))